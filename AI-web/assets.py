@@ -0,0 +1,120 @@
+"""
+In-memory static assets for the dashboard.
+
+Only allowlisted files are served. Each one is read once, hashed and
+precompressed with gzip (and brotli when installed). index.html is rewritten
+to reference the other assets by versioned URL, so those responses can be
+cached as immutable while index.html itself is revalidated on every load.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+INDEX = "index.html"
+# Served from the app directory; everything else there (data.db, data.csv, *.py) stays private
+PUBLIC_FILES = (INDEX, "chart.js")
+PUBLIC_EXTENSIONS = (".css", ".gif", ".ico", ".jpeg", ".jpg", ".png", ".svg")
+# Already-compressed formats gain nothing from gzip/brotli
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 512
+IMMUTABLE = "public, max-age=31536000, immutable"
+# src="/chart.js" or href="/static/style.css", optionally already versioned
+ASSET_REFERENCE = re.compile(r'((?:src|href)=")/(?:static/)?([^"?#]+)(?:\?[^"]*)?"')
+
+
+class Asset:
+    def __init__(self, name, body):
+        self.name = name
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type == "application/javascript":
+            self.media_type += "; charset=utf-8"
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        # encoding -> body, "identity" always present
+        self.bodies = {"identity": body}
+        if len(body) >= MIN_COMPRESS_BYTES and self.media_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.bodies["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.bodies["br"] = compressed
+
+    @property
+    def url(self):
+        return f"/static/{self.name}?v={self.version}"
+
+
+def accepted_encodings(header):
+    # Accept-Encoding tokens with a non-zero q value
+    accepted = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+class AssetCache:
+    def __init__(self):
+        self.assets = {}
+
+    def load(self, directory="."):
+        assets = {}
+        for name in sorted(os.listdir(directory)):
+            if name in PUBLIC_FILES or name.lower().endswith(PUBLIC_EXTENSIONS):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        assets[name] = Asset(name, f.read())
+        index = assets.get(INDEX)
+        if index is not None:
+            def versioned(match):
+                prefix, name = match.groups()
+                if name == INDEX or name not in assets:
+                    return match.group(0)
+                return f'{prefix}{assets[name].url}"'
+
+            html = ASSET_REFERENCE.sub(versioned, index.bodies["identity"].decode("utf-8"))
+            assets[INDEX] = Asset(INDEX, html.encode("utf-8"))
+        self.assets = assets
+        return len(assets)
+
+    def response(self, request: Request, name):
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        encoding = next((encoding for encoding in ("br", "gzip") if encoding in accepted and encoding in asset.bodies), "identity")
+        headers = {
+            # Strong validator per representation
+            "ETag": f'"{asset.version}-{encoding}"',
+            "Cache-Control": IMMUTABLE if request.query_params.get("v") == asset.version else "no-cache",
+        }
+        if len(asset.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if headers["ETag"] in tags or "*" in tags:
+                return Response(status_code=304, headers=headers)
+        return Response(asset.bodies[encoding], media_type=asset.media_type, headers=headers)
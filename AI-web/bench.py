@@ -0,0 +1,216 @@
+"""
+Benchmarks for the AI-web data paths.
+
+    python bench.py load --rows 10000 1000000 10000000 --clients 32
+    python bench.py columnar --rows 1000000 10000000
+
+Each size runs in its own process: it generates a synthetic data.csv in a
+temporary directory, ingests it with setup_database() and prints the timings as JSON. "load" drives the API
+with concurrent clients over an in-process ASGI transport; "columnar"
+compares SQLite and in-memory columnar aggregates.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+import main
+from columnar import ColumnStore
+
+CATEGORIES = ["呼吸道合胞病毒", "流感病毒", "腺病毒", "鼻病毒", "偏肺病毒", "其他", "新冠病毒", "支原体"]
+HOSPITALS = [f"Hospital {i}" for i in range(1, 21)]
+GENDERS = ["Male", "Female"]
+
+# (group_by, filters) pairs covering the pie chart and the secondary charts
+AGGREGATE_QUERIES = [
+    (["category_id"], {}),
+    (["hospital"], {"category_id": 1}),
+    (["gender", "age_band"], {}),
+    (["category_id", "hospital", "gender", "age_band"], {}),
+    (["age_band"], {"hospital": "Hospital 3", "gender": "Female"}),
+]
+
+
+def generate_csv(path, rows, seed=0):
+    # Zipf-like skew: the first categories and hospitals account for most rows
+    rng = random.Random(seed)
+    category_weights = [1 / (rank + 1) for rank in range(len(CATEGORIES))]
+    hospital_weights = [1 / (rank + 1) ** 0.5 for rank in range(len(HOSPITALS))]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("category,value,hospital,patient_name,gender,age\n")
+        remaining = rows
+        while remaining:
+            batch = min(remaining, 100000)
+            categories = rng.choices(CATEGORIES, category_weights, k=batch)
+            hospitals = rng.choices(HOSPITALS, hospital_weights, k=batch)
+            f.writelines(
+                f"{category},1,{hospital},Patient {remaining - i},{rng.choice(GENDERS)},{rng.randint(0, 95)}\n"
+                for i, (category, hospital) in enumerate(zip(categories, hospitals))
+            )
+            remaining -= batch
+
+
+def percentile(samples, q):
+    # Nearest-rank percentile of an already sorted list
+    return samples[min(len(samples) - 1, max(0, round(q / 100 * len(samples)) - 1))]
+
+
+def latency_report(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return {"median_ms": statistics.median(samples) * 1000, "min_ms": min(samples) * 1000}
+
+
+def prepare(directory, rows):
+    # main.py resolves DB_FILE and CSV_SOURCE relative to the working directory
+    os.chdir(directory)
+    generate_csv(main.CSV_SOURCE, rows)
+    started = time.perf_counter()
+    main.setup_database()
+    return time.perf_counter() - started
+
+
+def bench_columnar(rows, repeat):
+    with tempfile.TemporaryDirectory() as directory:
+        ingest_seconds = prepare(directory, rows)
+        conn = main.connect_readonly()
+        store = ColumnStore(main.AGE_BAND_WIDTH, main.AGE_BAND_UNKNOWN)
+        started = time.perf_counter()
+        store.load(conn)
+        load_seconds = time.perf_counter() - started
+
+        queries = []
+        for group_by, filters in AGGREGATE_QUERIES:
+            queries.append({
+                "group_by": group_by,
+                "filters": filters,
+                # aggregate_cube answers from a pre-grouped table
+                "sqlite_cube": time_call(lambda: main.sqlite_aggregate(conn, group_by, filters), repeat),
+                "columnar": time_call(lambda: store.aggregate(group_by, filters), repeat),
+            })
+        # The same group-by straight off chart_data, i.e. what the cube avoids
+        raw_scan = time_call(
+            lambda: conn.execute("SELECT category_id, hospital, gender, COUNT(*), SUM(value) FROM chart_data GROUP BY 1, 2, 3").fetchall(),
+            repeat,
+        )
+        conn.close()
+        return {
+            "rows": rows,
+            "ingest_s": ingest_seconds,
+            "columnar_load_s": load_seconds,
+            "sqlite_raw_scan": raw_scan,
+            "queries": queries,
+        }
+
+
+def load_scenarios(category_ids, rng):
+    # name -> function returning the next URL to request
+    return {
+        "/api/data": lambda: "/api/data",
+        "/api/details/{id}": lambda: f"/api/details/{rng.choice(category_ids)}",
+        "/api/details/{id}?shape=columns": lambda: f"/api/details/{rng.choice(category_ids)}?shape=columns",
+        "/api/aggregate": lambda: f"/api/aggregate?group_by=hospital&category_id={rng.choice(category_ids)}",
+    }
+
+
+async def drive(client, next_url, clients, total):
+    latencies = []
+    errors = 0
+    remaining = [total]
+
+    async def worker():
+        nonlocal errors
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            started = time.perf_counter()
+            response = await client.get(next_url())
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return latency_report(latencies, errors, time.perf_counter() - started)
+
+
+async def run_load(clients, requests):
+    rng = random.Random(0)
+    scenarios = load_scenarios(sorted(main.category_names()), rng)
+    transport = httpx.ASGITransport(app=main.app)
+    report = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, next_url in scenarios.items():
+            # One untimed request per scenario warms connections and caches
+            await client.get(next_url())
+            report[name] = await drive(client, next_url, clients, requests)
+    return report
+
+
+def bench_load(rows, clients, requests):
+    with tempfile.TemporaryDirectory() as directory:
+        ingest_seconds = prepare(directory, rows)
+        # A fresh event loop per size also means fresh threadpool threads,
+        # so no per-thread connection to a previous size's database is reused
+        endpoints = asyncio.run(run_load(clients, requests))
+        return {
+            "rows": rows,
+            "clients": clients,
+            "ingest_s": ingest_seconds,
+            "ingest_rows_per_s": rows / ingest_seconds,
+            "endpoints": endpoints,
+        }
+
+
+def run_isolated(fn, *args):
+    # Each size runs in a fresh spawned process: main's module state (response
+    # cache, broadcaster, per-thread connections, column store) would otherwise
+    # carry the previous size's data into this one
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    load = subparsers.add_parser("load", help="ingest time and concurrent API latency")
+    load.add_argument("--rows", type=int, nargs="+", default=[10000, 1000000])
+    load.add_argument("--clients", type=int, default=32)
+    load.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    columnar = subparsers.add_parser("columnar", help="SQLite vs in-memory columnar aggregates")
+    columnar.add_argument("--rows", type=int, nargs="+", default=[1000000])
+    columnar.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "load":
+        report = [run_isolated(bench_load, rows, args.clients, args.requests) for rows in args.rows]
+    elif args.command == "columnar":
+        report = [run_isolated(bench_columnar, rows, args.repeat) for rows in args.rows]
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,185 @@
+"""
+Columnar in-memory copy of chart_data for read-mostly dashboards.
+
+hospital and gender are dictionary-encoded, category_id is already an
+integer code, and every column is stored as an array('i'). Group-bys run as
+vectorised bincounts when NumPy is installed and as a plain loop otherwise.
+"""
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNS = ("category_id", "hospital", "gender", "value", "age")
+# Stored in the age column when chart_data has no usable integer age
+UNKNOWN_AGE = -1
+LOAD_BATCH_SIZE = 50000
+
+
+class Snapshot:
+    # Never mutated once published, so readers need no locking and NumPy
+    # views over the arrays stay valid while a newer snapshot is loaded
+    def __init__(self, previous=None):
+        self.last_id = previous.last_id if previous else 0
+        self.hospitals = list(previous.hospitals) if previous else []
+        self.genders = list(previous.genders) if previous else []
+        self.columns = {name: array('i', previous.columns[name] if previous else ()) for name in COLUMNS}
+        # NumPy group codes and cardinalities, built by the first query against this snapshot
+        self.numpy_codes = None
+
+    def __len__(self):
+        return len(self.columns["value"])
+
+
+class ColumnStore:
+    def __init__(self, age_band_width, age_band_unknown):
+        self.age_band_width = age_band_width
+        self.age_band_unknown = age_band_unknown
+        self.snapshot = Snapshot()
+
+    def load(self, conn, fresh=False):
+        # Appends the chart_data rows added since the last load, or rereads
+        # everything when fresh; readers keep the old snapshot until the swap
+        snapshot = Snapshot(None if fresh else self.snapshot)
+        columns = snapshot.columns
+        hospital_codes = {value: code for code, value in enumerate(snapshot.hospitals)}
+        gender_codes = {value: code for code, value in enumerate(snapshot.genders)}
+        cursor = conn.execute(
+            "SELECT id, category_id, hospital, gender, value, age FROM chart_data WHERE id > ? ORDER BY id",
+            (snapshot.last_id,),
+        )
+        count = 0
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            for row_id, category_id, hospital, gender, value, age in rows:
+                hospital = hospital or ''
+                gender = gender or ''
+                if hospital not in hospital_codes:
+                    hospital_codes[hospital] = len(snapshot.hospitals)
+                    snapshot.hospitals.append(hospital)
+                if gender not in gender_codes:
+                    gender_codes[gender] = len(snapshot.genders)
+                    snapshot.genders.append(gender)
+                columns["category_id"].append(category_id)
+                columns["hospital"].append(hospital_codes[hospital])
+                columns["gender"].append(gender_codes[gender])
+                columns["value"].append(value)
+                columns["age"].append(age if type(age) is int and age >= 0 else UNKNOWN_AGE)
+            snapshot.last_id = rows[-1][0]
+            count += len(rows)
+        self.snapshot = snapshot
+        return count
+
+    def aggregate(self, group_by, filters):
+        """
+        Same result as grouping aggregate_cube: one dict per group with the
+        group_by columns plus "count" and "value", sorted by the group_by columns.
+        """
+        snapshot = self.snapshot
+        if np is None:
+            groups = self._aggregate_python(snapshot, group_by, filters)
+        else:
+            groups = self._aggregate_numpy(snapshot, group_by, filters)
+        result = [dict(zip(group_by, key), count=count, value=value) for key, (count, value) in groups.items()]
+        result.sort(key=lambda item: tuple(item[name] for name in group_by))
+        return result
+
+    def _encode_filter(self, snapshot, column, value):
+        # Returns None when the value never occurs, i.e. the filter matches nothing
+        if column == "hospital":
+            return snapshot.hospitals.index(value) if value in snapshot.hospitals else None
+        if column == "gender":
+            return snapshot.genders.index(value) if value in snapshot.genders else None
+        return value
+
+    def _decode(self, snapshot, column, code):
+        if column == "hospital":
+            return snapshot.hospitals[code]
+        if column == "gender":
+            return snapshot.genders[code]
+        return code
+
+    def _band(self, age):
+        return self.age_band_unknown if age < 0 else age // self.age_band_width * self.age_band_width
+
+    def _aggregate_python(self, snapshot, group_by, filters):
+        columns = snapshot.columns
+        wanted = {}
+        for column, value in filters.items():
+            wanted[column] = self._encode_filter(snapshot, column, value)
+            if wanted[column] is None:
+                return {}
+        groups = {}
+        for i in range(len(snapshot)):
+            row = {
+                "category_id": columns["category_id"][i],
+                "hospital": columns["hospital"][i],
+                "gender": columns["gender"][i],
+                "age_band": self._band(columns["age"][i]),
+            }
+            if any(row[column] != value for column, value in wanted.items()):
+                continue
+            key = tuple(row[column] for column in group_by)
+            cell = groups.setdefault(key, [0, 0])
+            cell[0] += 1
+            cell[1] += columns["value"][i]
+        return {
+            tuple(self._decode(snapshot, column, code) for column, code in zip(group_by, key)): tuple(cell)
+            for key, cell in groups.items()
+        }
+
+    def _aggregate_numpy(self, snapshot, group_by, filters):
+        if not len(snapshot):
+            return {}
+        if snapshot.numpy_codes is None:
+            columns = {name: np.frombuffer(snapshot.columns[name], dtype=np.intc) for name in COLUMNS}
+            age = columns["age"]
+            codes = {
+                "category_id": columns["category_id"],
+                "hospital": columns["hospital"],
+                "gender": columns["gender"],
+                # Band index shifted by one so unknown ages get code 0
+                "age_band": np.where(age < 0, 0, age // self.age_band_width + 1),
+            }
+            cardinalities = {column: int(values.max()) + 1 for column, values in codes.items()}
+            snapshot.numpy_codes = (codes, cardinalities, columns["value"])
+        codes, cardinalities, values = snapshot.numpy_codes
+
+        mask = np.ones(len(snapshot), dtype=bool)
+        for column, value in filters.items():
+            code = self._encode_filter(snapshot, column, value)
+            if code is None:
+                return {}
+            if column == "age_band":
+                if code == self.age_band_unknown:
+                    code = 0
+                elif code < 0 or code % self.age_band_width:
+                    return {}
+                else:
+                    code = code // self.age_band_width + 1
+            mask &= codes[column] == code
+
+        # Mixed-radix key over the group_by columns, then one bincount for counts and one for sums
+        filtered = not mask.all()
+        key = np.zeros(int(mask.sum()), dtype=np.int64)
+        for column in group_by:
+            key = key * cardinalities[column] + (codes[column][mask] if filtered else codes[column])
+        counts = np.bincount(key)
+        sums = np.bincount(key, weights=values[mask] if filtered else values)
+
+        groups = {}
+        for index in np.nonzero(counts)[0].tolist():
+            decoded = []
+            remaining = index
+            for column in reversed(group_by):
+                remaining, code = divmod(remaining, cardinalities[column])
+                if column == "age_band":
+                    decoded.append(self.age_band_unknown if code == 0 else (code - 1) * self.age_band_width)
+                else:
+                    decoded.append(self._decode(snapshot, column, code))
+            groups[tuple(reversed(decoded))] = (int(counts[index]), int(sums[index]))
+        return groups
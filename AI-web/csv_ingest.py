@@ -0,0 +1,112 @@
+"""
+CSV parsing for setup_database().
+
+Kept apart from main.py so parse_csv() can be pickled by reference and
+depends only on the standard library. The spawned ingest workers still
+re-import the launching script as __mp_main__, so under `python main.py`
+they load FastAPI too.
+"""
+import csv
+import hashlib
+import itertools
+import pickle
+import re
+
+# A numeric literal as SQLite reads one from text, surrounding whitespace allowed
+NUMERIC = re.compile(r'[ \t\n\v\f\r]*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[ \t\n\v\f\r]*\Z', re.ASCII)
+
+
+def prefix_matches(f, length, digest, hasher):
+    # True when the first `length` bytes are unchanged and end on a row boundary
+    remaining = length
+    last = b'\n'
+    while remaining:
+        chunk = f.read(min(remaining, 1 << 20))
+        if not chunk:
+            return False
+        hasher.update(chunk)
+        remaining -= len(chunk)
+        last = chunk[-1:]
+    if hasher.hexdigest() != digest:
+        return False
+    # An unterminated last row only stayed intact if the appended data starts a new line
+    return last == b'\n' or f.read(1) in (b'\r', b'\n')
+
+
+def read_lines(f, hasher, consumed):
+    for line in f:
+        hasher.update(line)
+        consumed[0] += len(line)
+        yield line.decode('utf-8')
+
+
+def integer_affinity(value):
+    # The value SQLite stores for text in an INTEGER column: a number that is
+    # integral and fits in 64 bits becomes an int ("35.0" -> 35), other numbers
+    # a float, and anything else stays as it is
+    if not isinstance(value, str) or not NUMERIC.match(value):
+        return value
+    try:
+        number = int(value)
+    except ValueError:
+        number = float(value)
+        if number.is_integer() and -2**63 <= number < 2**63:
+            return int(number)
+        return number
+    return number if -2**63 <= number < 2**63 else float(number)
+
+
+class PrefixChanged(Exception):
+    pass
+
+
+def read_csv_chunks(path, offset, digest, fingerprint, batch_size):
+    # Yield the rows after `offset` in lists of up to batch_size, then store the
+    # new ingested_bytes and sha256 of the file in `fingerprint`
+    with open(path, 'rb') as f:
+        hasher = hashlib.sha256()
+        fieldnames = None
+        if offset:
+            if not prefix_matches(f, offset, digest, hasher):
+                raise PrefixChanged(path)
+            # Rows were only appended: keep the ingested prefix and read the tail
+            f.seek(0)
+            fieldnames = next(csv.reader([f.readline().decode('utf-8')]))
+            f.seek(offset)
+        consumed = [offset]
+        reader = csv.DictReader(read_lines(f, hasher, consumed), fieldnames=fieldnames)
+        rows = (
+            (row['category'].strip(), int(row['value']), row['hospital'], row['patient_name'], row['gender'], integer_affinity(row['age']))
+            for row in reader
+        )
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if not chunk:
+                break
+            yield chunk
+    fingerprint["ingested_bytes"] = consumed[0]
+    fingerprint["sha256"] = hasher.hexdigest()
+
+
+def parse_csv(job):
+    # Runs in a worker process. Chunks are pickled to the spool file as they
+    # are parsed, so neither process holds the rows of a whole file at once
+    path, offset, digest, batch_size, spool = job
+    fingerprint = {}
+    try:
+        with open(spool, 'wb') as out:
+            for chunk in read_csv_chunks(path, offset, digest, fingerprint, batch_size):
+                pickle.dump(chunk, out, pickle.HIGHEST_PROTOCOL)
+    except PrefixChanged:
+        return None
+    return fingerprint
+
+
+def read_spool(spool):
+    # Yield the chunks written by parse_csv() one at a time
+    with open(spool, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
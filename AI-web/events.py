@@ -0,0 +1,62 @@
+"""
+Server-sent events fan-out.
+
+The publisher (the ingest thread) stores one pre-encoded message and wakes
+every subscriber. Each subscriber is an async generator on the server's event
+loop that sends the latest message, so a slow client skips intermediate
+updates instead of queueing them.
+"""
+import asyncio
+import threading
+
+HEARTBEAT_SECONDS = 15
+
+
+def format_event(event, event_id, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n".encode("utf-8")
+
+
+class Broadcaster:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (loop, asyncio.Event) per open stream
+        self.subscribers = set()
+        # (event_id, encoded message) or None before the first publish
+        self.latest = None
+
+    def publish(self, event_id, message):
+        # Safe to call from any thread
+        with self.lock:
+            self.latest = (str(event_id), message)
+            subscribers = list(self.subscribers)
+        for loop, wakeup in subscribers:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # Event loop already closed; the stream's finally block removes it
+                pass
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    async def stream(self, last_event_id=None):
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            self.subscribers.add(subscriber)
+        try:
+            sent = last_event_id
+            while True:
+                latest = self.latest
+                if latest is not None and latest[0] != sent:
+                    sent = latest[0]
+                    yield latest[1]
+                try:
+                    await asyncio.wait_for(subscriber[1].wait(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # SSE comment line; keeps proxies from closing an idle stream
+                    yield b": keep-alive\n\n"
+                    continue
+                subscriber[1].clear()
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
@@ -1,24 +1,87 @@
 import sqlite3
-import csv
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+import argparse
+import collections
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from urllib.parse import unquote
 import uvicorn
 
+import metrics
+from assets import INDEX, AssetCache
+from columnar import ColumnStore
+from events import Broadcaster, format_event
+from csv_ingest import PrefixChanged, parse_csv, read_csv_chunks, read_spool
+
 app = FastAPI()
 
 # --- Database Setup ---
 DB_FILE = "data.db"
-category_map = {}
+# One CSV file, a directory of *.csv files or a glob such as "exports/*/2024-05-*.csv"
+CSV_SOURCE = os.environ.get("AI_WEB_DATA", "data.csv")
+# Worker processes that parse CSV files when a source matches several of them
+INGEST_WORKERS = int(os.environ.get("AI_WEB_INGEST_WORKERS", os.cpu_count() or 1))
+# Below this many bytes to parse, files are read in-process instead. Each
+# spawned worker re-imports the script that started the process (main.py
+# and FastAPI under `python main.py`), which takes on the order of a second.
+POOL_MIN_BYTES = 8 << 20
+# Seconds between checks of the CSV files for a hot reload; 0 disables the watcher
+RELOAD_INTERVAL = float(os.environ.get("AI_WEB_RELOAD_INTERVAL", "5"))
+# Set for uvicorn workers serving a database that another process ingests
+# (`python main.py serve --workers N` sets it); such workers never write to data.db
+READ_ONLY = os.environ.get("AI_WEB_READONLY") == "1"
+# Seconds between a read-only worker's checks for a newly committed ingest
+FOLLOW_INTERVAL = 1.0
+# Bump whenever the chart_data layout (or how aggregate_cube is derived from
+# it) changes; a mismatch forces a full rebuild.
+SCHEMA_VERSION = 9
+# Rows per executemany call during ingest
+BATCH_SIZE = 50000
+# Ages are grouped into bands of this width; rows without a usable age go to AGE_BAND_UNKNOWN
+AGE_BAND_WIDTH = 10
+AGE_BAND_UNKNOWN = -1
+# ((data_version, data_updated_at), category -> category_id, category_id -> category),
+# reloaded from the categories table once the version moves past it
+category_cache = None
+# Bumped on every ingest; API responses are cached and validated against it
+data_version = 0
+data_updated_at = 0.0
+# AI_WEB_ENGINE=columnar keeps an in-memory columnar copy of chart_data and
+# answers /api/data and /api/aggregate from it instead of from SQLite
+column_store = ColumnStore(AGE_BAND_WIDTH, AGE_BAND_UNKNOWN) if os.environ.get("AI_WEB_ENGINE") == "columnar" else None
 
-def setup_database():
-    global category_map
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Drop table if it exists to ensure fresh data and schema
+
+def create_schema(cursor):
+    # Category ids are part of URLs such as /api/details/3, so this table
+    # survives rebuilds and an id is never reassigned to another category
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            category_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL UNIQUE
+        )
+    ''')
+    if cursor.execute("SELECT COUNT(*) FROM categories").fetchone()[0] == 0:
+        # Databases from before the categories table keep the ids they had
+        try:
+            cursor.execute("INSERT INTO categories (category_id, category) SELECT category_id, category FROM category_totals")
+        except sqlite3.OperationalError:
+            pass
+    # Drop tables if they exist to ensure fresh data and schema
     cursor.execute("DROP TABLE IF EXISTS chart_data")
-    # Create table with new columns
+    cursor.execute("DROP TABLE IF EXISTS category_totals")
+    cursor.execute("DROP TABLE IF EXISTS aggregate_cube")
+    cursor.execute("DROP TABLE IF EXISTS ingest_state")
+    cursor.execute("DROP TABLE IF EXISTS build_info")
     cursor.execute('''
         CREATE TABLE chart_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -31,88 +94,807 @@ def setup_database():
             age INTEGER
         )
     ''')
+    # Per-category SUM(value), maintained at ingest time so /api/data never scans chart_data
+    cursor.execute('''
+        CREATE TABLE category_totals (
+            category_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            value INTEGER NOT NULL
+        )
+    ''')
+    # Row count and SUM(value) per (category, hospital, gender, age band); every
+    # /api/aggregate slice is a GROUP BY over this instead of over chart_data
+    cursor.execute('''
+        CREATE TABLE aggregate_cube (
+            category_id INTEGER NOT NULL,
+            hospital TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            age_band INTEGER NOT NULL,
+            patients INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (category_id, hospital, gender, age_band)
+        ) WITHOUT ROWID
+    ''')
+    # Fingerprint of every source file: how many bytes were ingested and their hash
+    cursor.execute('''
+        CREATE TABLE ingest_state (
+            source TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            ingested_bytes INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        )
+    ''')
+    # When the tables above were last rebuilt; chart_data ids restart after a
+    # rebuild, so a process following the database cannot just append past its last id
+    cursor.execute('''
+        CREATE TABLE build_info (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            built_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT INTO build_info (id, built_at) VALUES (0, ?)", (time.time(),))
+    # Not dropped with the rest, so the version keeps counting up across rebuilds
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def load_category_map(cursor):
+    cursor.execute("SELECT category, category_id FROM categories")
+    return dict(cursor.fetchall())
+
+
+def load_data_version(cursor):
+    cursor.execute("SELECT version, updated_at FROM data_version WHERE id = 0")
+    return cursor.fetchone() or (0, 0.0)
+
+
+def load_built_at(cursor):
+    cursor.execute("SELECT built_at FROM build_info WHERE id = 0")
+    return cursor.fetchone()[0]
+
+
+def parse_sources(jobs, stats):
+    # Yield (path, chunks, fingerprint) in job order. A single file is streamed
+    # in this process; several are parsed in a process pool while this process
+    # stays the only writer. Workers spool their chunks to temporary files and
+    # this process reads them back one chunk at a time, so memory stays bounded
+    # by BATCH_SIZE however large the files are; at most two files per worker
+    # are parsed ahead of the writer.
+    # Starting the pool costs more than it saves on a few small files
+    tail_bytes = sum(stats[path].st_size - offset for path, offset, digest in jobs)
+    if len(jobs) <= 1 or INGEST_WORKERS <= 1 or tail_bytes < POOL_MIN_BYTES:
+        for path, offset, digest in jobs:
+            fingerprint = {}
+            yield path, read_csv_chunks(path, offset, digest, fingerprint, BATCH_SIZE), fingerprint
+        return
+
+    # spawn rather than fork: a reload runs next to the server's threads.
+    # Spawn re-runs the parent's __main__ module in every worker, so this pool
+    # pays the full import cost of main.py once per worker.
+    pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    spool_dir = tempfile.TemporaryDirectory(prefix="ai-web-ingest-")
+    try:
+        def submit(index, job):
+            spool = os.path.join(spool_dir.name, f"{index}.pickle")
+            return job[0], spool, pool.submit(parse_csv, job + (BATCH_SIZE, spool))
+
+        remaining = enumerate(jobs)
+        pending = collections.deque(
+            submit(index, job) for index, job in itertools.islice(remaining, INGEST_WORKERS * 2)
+        )
+        while pending:
+            path, spool, future = pending.popleft()
+            queued = next(remaining, None)
+            if queued is not None:
+                pending.append(submit(*queued))
+            fingerprint = future.result()
+            if fingerprint is None:
+                raise PrefixChanged(path)
+            yield path, read_spool(spool), fingerprint
+            os.remove(spool)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        spool_dir.cleanup()
+
+
+def create_indexes(cursor):
+    # Built after the bulk load so rows are not inserted into a live B-tree one by one
+    # (category_id, rowid) order lets detail lookups seek straight to one category
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chart_data_category_id ON chart_data (category_id)")
+
+
+def age_band(age):
+    # `age` is already coerced the way chart_data stores it, so the band matches
+    # what the columnar store derives from the table. Negative, fractional and
+    # non-numeric ages are data errors and count as unknown.
+    if type(age) is not int or age < 0:
+        return AGE_BAND_UNKNOWN
+    return age // AGE_BAND_WIDTH * AGE_BAND_WIDTH
+
+
+def load_rows(cursor, chunks, categories):
+    # Insert the CSV chunk by chunk so memory stays bounded by BATCH_SIZE
+    count = 0
+    for chunk in chunks:
+        # Assign IDs to categories not seen before, after the ones already stored
+        new_categories = sorted(set(row[0] for row in chunk) - categories.keys())
+        next_id = max(categories.values(), default=-1) + 1
+        for offset, cat in enumerate(new_categories):
+            categories[cat] = next_id + offset
+        cursor.executemany(
+            "INSERT INTO categories (category_id, category) VALUES (?, ?)",
+            [(categories[cat], cat) for cat in new_categories],
+        )
 
-    # Populate the database from CSV
-    with open('data.csv', 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        raw_data = []
-        for row in reader:
-            raw_data.append({
-                'category': row['category'].strip(),
-                'value': row['value'],
-                'hospital': row['hospital'],
-                'patient_name': row['patient_name'],
-                'gender': row['gender'],
-                'age': row['age']
-            })
-
-    # Assign unique IDs to categories and build the map
-    unique_categories = sorted(list(set([d['category'] for d in raw_data])))
-    category_map = {cat: idx for idx, cat in enumerate(unique_categories)}
-
-    to_db = []
-    for d in raw_data:
-        cat_id = category_map[d['category']]
-        to_db.append((cat_id, d['category'], d['value'], d['hospital'], d['patient_name'], d['gender'], d['age']))
-
-    cursor.executemany(
-        "INSERT INTO chart_data (category_id, category, value, hospital, patient_name, gender, age) VALUES (?, ?, ?, ?, ?, ?, ?);",
-        to_db,
+        to_db = []
+        totals = {}
+        cube = {}
+        for category, value, hospital, patient_name, gender, age in chunk:
+            to_db.append((categories[category], category, value, hospital, patient_name, gender, age))
+            totals[category] = totals.get(category, 0) + value
+            key = (categories[category], hospital or '', gender or '', age_band(age))
+            cell = cube.get(key)
+            if cell is None:
+                cube[key] = [1, value]
+            else:
+                cell[0] += 1
+                cell[1] += value
+        cursor.executemany(
+            "INSERT INTO chart_data (category_id, category, value, hospital, patient_name, gender, age) VALUES (?, ?, ?, ?, ?, ?, ?);",
+            to_db,
+        )
+        cursor.executemany(
+            "INSERT INTO category_totals (category_id, category, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (category_id) DO UPDATE SET value = value + excluded.value;",
+            [(categories[cat], cat, total) for cat, total in totals.items()],
+        )
+        cursor.executemany(
+            "INSERT INTO aggregate_cube (category_id, hospital, gender, age_band, patients, value) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET patients = patients + excluded.patients, value = value + excluded.value;",
+            [key + tuple(cell) for key, cell in cube.items()],
+        )
+        count += len(to_db)
+    return count
+
+
+def load_sources(cursor, jobs, categories, stats):
+    count = 0
+    for path, chunks, fingerprint in parse_sources(jobs, stats):
+        count += load_rows(cursor, chunks, categories)
+        cursor.execute(
+            "INSERT OR REPLACE INTO ingest_state (source, size, mtime, ingested_bytes, sha256) VALUES (?, ?, ?, ?, ?)",
+            (path, stats[path].st_size, stats[path].st_mtime, fingerprint["ingested_bytes"], fingerprint["sha256"]),
+        )
+    return count
+
+
+def source_files():
+    if os.path.isdir(CSV_SOURCE):
+        return sorted(glob.glob(os.path.join(CSV_SOURCE, "*.csv")))
+    return sorted(glob.glob(CSV_SOURCE))
+
+
+def source_fingerprint():
+    return tuple((path, stat.st_size, stat.st_mtime) for path, stat in ((path, os.stat(path)) for path in source_files()))
+
+
+def publish(categories, version):
+    # Swap the in-process state only after the transaction is committed, so
+    # requests never see a half-built category map during a reload
+    global category_cache, data_version, data_updated_at
+    category_cache = (tuple(version), categories, {cat_id: cat for cat, cat_id in categories.items()})
+    data_version, data_updated_at = version
+
+
+def load_categories():
+    # The ingest publishes the dictionary it built; anything else (a cache
+    # invalidated by a newer data_version) reads it back from the database
+    global category_cache
+    cache = category_cache
+    version = current_version()
+    if cache is None or cache[0] != version:
+        rows = run_query(get_connection(), "categories", "SELECT category, category_id FROM categories", tuples=True)
+        categories = dict(rows)
+        cache = category_cache = (version, categories, {cat_id: cat for cat, cat_id in categories.items()})
+    return cache
+
+
+def category_names():
+    # category_id -> category
+    return load_categories()[2]
+
+
+def ingest_csv():
+    files = source_files()
+    if not files:
+        # Keep serving the current data rather than treating a missing export as "no rows"
+        raise FileNotFoundError(f"No CSV files match {CSV_SOURCE}")
+    stats = {path: os.stat(path) for path in files}
+
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+
+    states = {}
+    cursor.execute("PRAGMA user_version")
+    schema_ok = cursor.fetchone()[0] == SCHEMA_VERSION
+    if schema_ok:
+        cursor.execute("SELECT source, size, mtime, ingested_bytes, sha256 FROM ingest_state")
+        states = {row[0]: row[1:] for row in cursor.fetchall()}
+    changed = [path for path in files if states.get(path, (None, None))[:2] != (stats[path].st_size, stats[path].st_mtime)]
+
+    # Unchanged files: keep the existing tables (and the warm page cache) as they are
+    if schema_ok and not changed and states.keys() == set(files):
+        if column_store is not None:
+            column_store.load(conn)
+        publish(load_category_map(cursor), load_data_version(cursor))
+        conn.close()
+        print(f"{CSV_SOURCE} unchanged, skipping ingest")
+        return
+
+    # The whole load is one transaction. After a crash the rows and ingest_state
+    # still agree, and in WAL mode readers keep their snapshot of the old data
+    # until the commit, which is what makes a reload under live traffic safe.
+    cursor.execute("PRAGMA synchronous = OFF")
+    started = time.perf_counter()
+    # Rows of a removed file cannot be taken out one by one, so that rebuilds everything
+    full = not schema_ok or not states.keys() <= set(files)
+    if not full:
+        mode = "incremental"
+        cursor.execute("BEGIN")
+        categories = load_category_map(cursor)
+        jobs = []
+        for path in changed:
+            state = states.get(path)
+            jobs.append((path, state[2], state[3]) if state else (path, 0, None))
+        try:
+            count = load_sources(cursor, jobs, categories, stats)
+        except PrefixChanged as e:
+            print(f"{e} was rewritten, not appended to")
+            conn.rollback()
+            full = True
+    if full:
+        mode = "full rebuild"
+        cursor.execute("BEGIN")
+        create_schema(cursor)
+        categories = load_category_map(cursor)
+        jobs = [(path, 0, None) for path in files]
+        count = load_sources(cursor, jobs, categories, stats)
+
+    create_indexes(cursor)
+    cursor.execute(
+        "INSERT INTO data_version (id, version, updated_at) VALUES (0, 1, ?) "
+        "ON CONFLICT (id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at",
+        (time.time(),),
     )
+    version = load_data_version(cursor)
     conn.commit()
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    elapsed = time.perf_counter() - started
+    print(f"Ingested {count} rows from {len(jobs)} file(s) ({mode}) in {elapsed:.2f}s, {count / max(elapsed, 1e-9):.0f} rows/sec")
+    if column_store is not None:
+        column_store.load(conn, fresh=(mode == "full rebuild"))
+    publish(categories, version)
     conn.close()
 
 
+# Serialises the startup ingest and the reloads triggered by watch_csv()
+ingest_lock = threading.Lock()
+
+
+def setup_database():
+    with ingest_lock:
+        ingest_csv()
+        broadcast_totals()
+
+
+def watch_csv(stop):
+    # Poll the CSV files and reload once their sizes and mtimes have stayed
+    # the same for a whole interval, so an export still being written is not picked up
+    last_loaded = source_fingerprint()
+    pending = None
+    while not stop.wait(RELOAD_INTERVAL):
+        try:
+            fingerprint = source_fingerprint()
+        except FileNotFoundError:
+            continue
+        if fingerprint == last_loaded:
+            pending = None
+        elif fingerprint != pending:
+            pending = fingerprint
+        else:
+            print(f"{CSV_SOURCE} changed, reloading...")
+            try:
+                setup_database()
+                last_loaded = fingerprint
+            except Exception as e:
+                print(f"Reload failed, still serving the previous data: {e}")
+            pending = None
+
+
+# build_info.built_at of the data a read-only worker last loaded
+loaded_built_at = None
+
+
+def refresh_from_database():
+    # Read-only workers: publish an ingest committed by another process.
+    # Returns whether there was anything new.
+    global loaded_built_at
+    conn = connect_readonly()
+    conn.row_factory = None
+    try:
+        cursor = conn.cursor()
+        # One read transaction, so the version, categories and rows are one snapshot
+        cursor.execute("BEGIN")
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] != SCHEMA_VERSION:
+            raise sqlite3.OperationalError("data.db has not been built with the current schema yet")
+        version = load_data_version(cursor)
+        # updated_at too: a recreated data.db starts again at version 1
+        if version == current_version():
+            return False
+        built_at = load_built_at(cursor)
+        if column_store is not None:
+            column_store.load(conn, fresh=built_at != loaded_built_at)
+        categories = load_category_map(cursor)
+        conn.rollback()
+    finally:
+        conn.close()
+    loaded_built_at = built_at
+    publish(categories, version)
+    broadcast_totals()
+    return True
+
+
+def follow_database(stop):
+    while not stop.wait(FOLLOW_INTERVAL):
+        try:
+            if refresh_from_database():
+                print(f"Loaded data version {data_version} committed by the ingest process")
+        except sqlite3.Error as e:
+            print(f"Could not refresh from {DB_FILE}: {e}")
+
+
+def wait_for_database(stop):
+    # A worker may start before the ingest process has finished the first build
+    while True:
+        try:
+            refresh_from_database()
+            return
+        except sqlite3.Error as e:
+            print(f"Waiting for {DB_FILE}: {e}")
+        if stop.wait(FOLLOW_INTERVAL):
+            return
+
+
+watch_stop = threading.Event()
+
+
 @app.on_event("startup")
 async def startup_event():
     print("Running startup event...")
-    setup_database()
+    if READ_ONLY:
+        wait_for_database(watch_stop)
+        threading.Thread(target=follow_database, args=(watch_stop,), daemon=True).start()
+    else:
+        setup_database()
+        if RELOAD_INTERVAL > 0:
+            threading.Thread(target=watch_csv, args=(watch_stop,), daemon=True).start()
+    print(f"Loaded {asset_cache.load()} static assets")
 
 
-# --- API Endpoints ---
-@app.get("/api/data")
-async def get_data():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+@app.on_event("shutdown")
+async def shutdown_event():
+    watch_stop.set()
+
+
+# --- Metrics ---
+# The progress handler fires every PROGRESS_STEPS SQLite VM instructions
+PROGRESS_STEPS = 1000
+
+metrics_registry = metrics.Registry()
+request_latency = metrics_registry.histogram(
+    "aiweb_http_request_duration_seconds",
+    "Time until the response starts, by route template",
+    ("method", "route", "status"),
+)
+query_latency = metrics_registry.histogram(
+    "aiweb_sqlite_query_duration_seconds",
+    "Time spent executing and fetching read queries",
+    ("query",),
+)
+query_rows = metrics_registry.counter("aiweb_sqlite_query_rows_total", "Rows returned by read queries", ("query",))
+query_steps = metrics_registry.counter(
+    "aiweb_sqlite_vm_steps_total",
+    f"SQLite VM instructions run by read queries, in units of {PROGRESS_STEPS}",
+    ("query",),
+)
+statement_count = metrics_registry.counter(
+    "aiweb_sqlite_statements_total",
+    "Statements run on read connections, by leading keyword",
+    ("statement",),
+)
+encode_latency = metrics_registry.histogram(
+    "aiweb_json_encode_duration_seconds",
+    "Time spent encoding JSON response bodies",
+    ("endpoint",),
+)
+progress_local = threading.local()
+
+
+def trace_statement(sql):
+    statement_count.inc(statement=sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "")
+
+
+def count_progress():
+    # Runs on the thread executing the statement; returning 0 lets it continue
+    progress_local.steps = getattr(progress_local, "steps", 0) + 1
+    return 0
+
+
+class QueryStats:
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.steps = 0
+        self.rows = 0
+
+    def run(self, fn):
+        # Calls fn on this thread and charges its time and VM steps to the query
+        steps = getattr(progress_local, "steps", 0)
+        started = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.steps += getattr(progress_local, "steps", 0) - steps
+
+    def record(self):
+        query_latency.observe(self.seconds, query=self.name)
+        query_rows.inc(self.rows, query=self.name)
+        query_steps.inc(self.steps, query=self.name)
+
+
+def run_query(conn, name, sql, params=(), tuples=False):
+    # tuples=True skips sqlite3.Row for callers that encode rows positionally
     cursor = conn.cursor()
-    # Aggregate data for the pie chart, returning category_id as well
-    cursor.execute("SELECT category_id, category, SUM(value) as value FROM chart_data GROUP BY category_id, category")
-    data = cursor.fetchall()
-    conn.close()
+    if tuples:
+        cursor.row_factory = None
+    stats = QueryStats(name)
+    rows = stats.run(lambda: cursor.execute(sql, params).fetchall())
+    stats.rows = len(rows)
+    stats.record()
+    return rows
+
+
+def encode_json(content):
+    # Tuples encode as arrays, so row tuples need no conversion
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def timed_json(endpoint, content, headers):
+    # Returning a Response with pre-encoded bytes bypasses FastAPI's jsonable_encoder
+    started = time.perf_counter()
+    body = encode_json(content)
+    encode_latency.observe(time.perf_counter() - started, endpoint=endpoint)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # The matched route's template keeps /api/details/{category_id} to one series
+    route = request.scope.get("route")
+    request_latency.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    return response
+
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# --- Read Connections ---
+db_local = threading.local()
+
+
+def connect_readonly(check_same_thread=True):
+    conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    conn.set_trace_callback(trace_statement)
+    conn.set_progress_handler(count_progress, PROGRESS_STEPS)
+    return conn
+
+
+def get_connection():
+    # One read-only connection per worker thread, kept open so sqlite3's
+    # statement cache reuses the prepared queries across requests. It is
+    # reopened once per published version: a recreated data.db is a new file
+    # that a connection to the deleted one would never see.
+    conn = getattr(db_local, "conn", None)
+    version = current_version()
+    if conn is None or db_local.version != version:
+        # The old connection is closed once no streaming cursor holds it
+        conn = connect_readonly()
+        db_local.conn = conn
+        db_local.version = version
+    return conn
+
+
+# --- HTTP Caching ---
+# key -> ((data_version, data_updated_at), encoded JSON body)
+response_cache = {}
+
+
+def current_version():
+    # data_version restarts at 1 when data.db is recreated; updated_at tells
+    # the two databases apart, so both are part of every cache key
+    return data_version, data_updated_at
+
+
+def version_tag(version):
+    return f"{version[0]}-{int(version[1] * 1000):x}"
+
+
+def cache_headers(version=None):
+    version = version or current_version()
+    return {
+        "ETag": f'"{version_tag(version)}"',
+        "Last-Modified": formatdate(version[1], usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+
+def not_modified(request, headers):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return headers["ETag"] in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(data_updated_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cached_json(request, key, build):
+    version = current_version()
+    headers = cache_headers(version)
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    cached = response_cache.get(key)
+    if cached is None or cached[0] != version:
+        content = build()
+        started = time.perf_counter()
+        body = encode_json(content)
+        encode_latency.observe(time.perf_counter() - started, endpoint=key)
+        cached = response_cache[key] = (version, body)
+    return Response(cached[1], media_type="application/json", headers=headers)
+
+
+# --- API Endpoints ---
+# Plain `def` endpoints run in FastAPI's threadpool, keeping SQLite off the event loop
+def build_data():
+    if column_store is not None:
+        names = category_names()
+        return [
+            {"category_id": row["category_id"], "category": names.get(row["category_id"]), "value": row["value"]}
+            for row in column_store.aggregate(["category_id"], {})
+        ]
+    # Aggregate data for the pie chart, precomputed at ingest time
+    data = run_query(get_connection(), "category_totals", "SELECT category_id, category, value FROM category_totals ORDER BY category_id")
     return [dict(row) for row in data]
 
 
+@app.get("/api/data")
+def get_data(request: Request):
+    return cached_json(request, "data", build_data)
+
+
+# Pushes the /api/data payload to every open dashboard after each ingest
+totals_broadcaster = Broadcaster()
+
+
+def broadcast_totals():
+    # Computed and encoded once per data version, whatever the number of
+    # subscribers. The event id is the data ETag, so a recreated data.db
+    # (version back at 1) is still a new event.
+    version = current_version()
+    event_id = version_tag(version)
+    if totals_broadcaster.latest is not None and totals_broadcaster.latest[0] == event_id:
+        return
+    body = encode_json(build_data())
+    response_cache["data"] = (version, body)
+    totals_broadcaster.publish(event_id, format_event("totals", event_id, body.decode("utf-8")))
+
+
+@app.get("/api/events")
+async def get_events(request: Request):
+    # A reconnecting EventSource sends the id it last saw, so an unchanged
+    # version is not sent again
+    return StreamingResponse(
+        totals_broadcaster.stream(request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Keyset pagination: (category_id, id) is the order of idx_chart_data_category_id
+DETAILS_COLUMNS = ("id", "hospital", "patient_name", "gender", "age")
+DETAILS_QUERY = (
+    f"SELECT {', '.join(DETAILS_COLUMNS)} FROM chart_data "
+    "WHERE category_id = ? AND id > ? ORDER BY id LIMIT ?"
+)
+STREAM_BATCH_SIZE = 500
+
+
+def stream_details(category_id, after_id, limit, shape):
+    # Starlette advances this generator from whichever threadpool thread is
+    # free, so it cannot use the per-thread connection
+    conn = connect_readonly(check_same_thread=False)
+    conn.row_factory = None
+    # Only time spent inside SQLite counts, not time waiting on the client
+    stats = QueryStats("details_stream")
+    try:
+        cursor = stats.run(lambda: conn.execute(DETAILS_QUERY, (category_id, after_id, limit)))
+        if shape == "columns":
+            # Header line with the column names, then one array per row
+            yield json.dumps(DETAILS_COLUMNS) + "\n"
+        while True:
+            rows = stats.run(lambda: cursor.fetchmany(STREAM_BATCH_SIZE))
+            if not rows:
+                break
+            stats.rows += len(rows)
+            if shape == "columns":
+                yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+            else:
+                yield "".join(json.dumps(dict(zip(DETAILS_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+    finally:
+        conn.close()
+        stats.record()
+
+
 @app.get("/api/details/{category_id}")
-async def get_details(category_id: int):
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Get the category name from the category_map using the category_id
-    category_name = None
-    for cat, cat_id in category_map.items():
-        if cat_id == category_id:
-            category_name = cat
-            break
-
-    if category_name is None:
+def get_details(
+    request: Request,
+    category_id: int,
+    after_id: int = 0,
+    limit: Optional[int] = Query(None, ge=1),
+    format: Literal["json", "ndjson"] = "json",
+    shape: Literal["records", "columns"] = "records",
+):
+    if category_id not in category_names():
         raise HTTPException(status_code=404, detail="Category not found")
 
-    cursor.execute("SELECT hospital, patient_name, gender, age FROM chart_data WHERE category = ?", (category_name,))
-    details = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in details]
+    # Detail pages only change on ingest too, so they share the data ETag
+    headers = cache_headers()
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    # LIMIT -1 means no limit in SQLite
+    limit = limit or -1
+    if format == "ndjson":
+        return StreamingResponse(stream_details(category_id, after_id, limit, shape), media_type="application/x-ndjson", headers=headers)
+
+    details = run_query(get_connection(), "details", DETAILS_QUERY, (category_id, after_id, limit), tuples=True)
+    if shape == "columns":
+        # Rows go to the encoder as the tuples SQLite returned
+        return timed_json("details", {"columns": DETAILS_COLUMNS, "rows": details}, headers)
+    return timed_json("details", [dict(zip(DETAILS_COLUMNS, row)) for row in details], headers)
+
+
+# group_by / filter name -> aggregate_cube column
+AGGREGATE_DIMENSIONS = {
+    "category": "category_id",
+    "hospital": "hospital",
+    "gender": "gender",
+    "age_band": "age_band",
+}
+
+
+def sqlite_aggregate(conn, columns, filters):
+    query = f"SELECT {', '.join(columns)}, SUM(patients) AS count, SUM(value) AS value FROM aggregate_cube"
+    if filters:
+        query += " WHERE " + " AND ".join(f"{column} = ?" for column in filters)
+    query += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+    return [dict(row) for row in run_query(conn, "aggregate_cube", query, list(filters.values()))]
+
+
+@app.get("/api/aggregate")
+def get_aggregate(
+    request: Request,
+    group_by: List[Literal["category", "hospital", "gender", "age_band"]] = Query(["category"]),
+    category_id: Optional[int] = None,
+    hospital: Optional[str] = None,
+    gender: Optional[str] = None,
+    age_band: Optional[int] = None,
+):
+    headers = cache_headers()
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    columns = [AGGREGATE_DIMENSIONS[name] for name in dict.fromkeys(group_by)]
+    filters = {}
+    for column, value in (("category_id", category_id), ("hospital", hospital), ("gender", gender), ("age_band", age_band)):
+        if value is not None:
+            filters[column] = value
+
+    if column_store is not None:
+        rows = column_store.aggregate(columns, filters)
+    else:
+        rows = sqlite_aggregate(get_connection(), columns, filters)
+    names = category_names()
+    result = []
+    for item in rows:
+        if "category_id" in item:
+            item["category"] = names.get(item["category_id"])
+        if item.get("age_band") == AGE_BAND_UNKNOWN:
+            item["age_band"] = None
+        result.append(item)
+    return timed_json("aggregate", result, headers)
 
 
 # --- Static Files ---
-app.mount("/static", StaticFiles(directory="."), name="static")
+# Allowlisted, precompressed and held in memory; data.db and data.csv are never served
+asset_cache = AssetCache()
+
+
+@app.get("/static/{name}")
+async def read_static(request: Request, name: str):
+    response = asset_cache.response(request, name)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return response
 
 
 @app.get("/")
-async def read_index():
-    return FileResponse('index.html')
+async def read_index(request: Request):
+    return asset_cache.response(request, INDEX)
 
 
 # --- Main (for direct execution, though uvicorn is preferred) ---
+def serve(host, port, workers):
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+    # This process is the only writer: it builds data.db once and keeps the
+    # hot reload running, while the workers open the database read-only and
+    # follow data_version
+    setup_database()
+    if RELOAD_INTERVAL > 0:
+        threading.Thread(target=watch_csv, args=(watch_stop,), daemon=True).start()
+    os.environ["AI_WEB_READONLY"] = "1"
+    uvicorn.run("main:app", host=host, port=port, workers=workers)
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=9999)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="AI-web dashboard server")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve", help="serve the dashboard (the default)")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=9999)
+    serve_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes sharing data.db read-only")
+    subparsers.add_parser("ingest", help="build or update data.db from the CSV source and exit")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        setup_database()
+    elif args.command == "serve":
+        serve(args.host, args.port, args.workers)
+    else:
+        serve("0.0.0.0", 9999, 1)
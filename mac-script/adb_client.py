@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+ADB 服务器 smart-socket 协议客户端
+直接连接本机 adb server（localhost:5037），代替每次调用都启动一个 adb 子进程
+
+协议：客户端发送 4 位十六进制长度 + 请求内容，服务器回复 "OKAY" 或 "FAIL" + 4 位十六进制长度 + 错误信息。
+- host:* 请求每次使用一个新连接，服务器回复后即关闭（本机 TCP 连接，耗时不到 1 毫秒）
+- host:track-devices 是长连接，设备列表每次变化时服务器主动推送，DeviceTracker 用它维护设备状态
+- shell 命令先发送 host:transport:<serial> 切换到设备，再在同一连接上发送 shell:<命令>，输出读到连接关闭为止
+
+FakeAdbServer 是一个协议兼容的假 adb server，用于在没有 adb 和真机的环境下测试扫描逻辑：
+    python adb_client.py --fake 5037
+scan_selftest.py 用它完整运行一次 ADBScanner.scan_devices（目标设备与非目标设备各一次）：
+    python scan_selftest.py
+"""
+
+import os
+import re
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+
+ADB_SERVER_HOST = "127.0.0.1"
+# 与 adb 命令行一致，可通过 ANDROID_ADB_SERVER_PORT 指定端口
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+
+# 设备信息字段 -> getprop 属性名
+DEVICE_PROPERTIES = {
+    "model": "ro.product.model",
+    "manufacturer": "ro.product.manufacturer",
+    "sdk": "ro.build.version.sdk",
+    "android": "ro.build.version.release",
+    "serial": "ro.serialno",
+    "abi": "ro.product.cpu.abi",
+}
+
+
+class AdbError(Exception):
+    """adb server 返回 FAIL 或连接异常"""
+    pass
+
+
+def encode_request(request):
+    data = request.encode('utf-8')
+    return f"{len(data):04x}".encode('ascii') + data
+
+
+def recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise AdbError("adb server 意外关闭了连接")
+        data += chunk
+    return data
+
+
+def recv_until_close(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def read_length_prefixed(sock):
+    size = int(recv_exact(sock, 4), 16)
+    return recv_exact(sock, size).decode('utf-8', errors='replace')
+
+
+def read_status(sock):
+    status = recv_exact(sock, 4)
+    if status == b'OKAY':
+        return
+    if status == b'FAIL':
+        raise AdbError(read_length_prefixed(sock))
+    raise AdbError(f"无法识别的 adb 响应: {status!r}")
+
+
+def parse_getprop(text):
+    """解析不带参数的 getprop 输出（每行 "[属性名]: [值]"，值可能跨行）为字典"""
+    return dict(re.findall(r'^\[([^\]]+)\]: \[(.*?)\]\r?$', text, re.M | re.S))
+
+
+def device_summary(props):
+    """从完整属性字典中取出型号、制造商、SDK、Android 版本、序列号和 ABI，缺失的为空字符串"""
+    return {field: props.get(name, '').strip() for field, name in DEVICE_PROPERTIES.items()}
+
+
+def parse_devices(text):
+    """解析 host:devices 的输出为 {serial: state}"""
+    devices = {}
+    for line in text.splitlines():
+        parts = line.split('\t')
+        if len(parts) >= 2:
+            devices[parts[0]] = parts[1]
+    return devices
+
+
+class AdbClient:
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.server_started = False
+
+    def open(self, timeout=None):
+        """打开一个到 adb server 的连接；服务器未运行时启动一次 adb start-server"""
+        try:
+            return socket.create_connection((self.host, self.port), timeout=timeout or self.timeout)
+        except ConnectionRefusedError:
+            if self.server_started or self.host != ADB_SERVER_HOST:
+                raise
+            self.server_started = True
+            try:
+                subprocess.run(['adb', 'start-server'], capture_output=True, timeout=10)
+            except (OSError, subprocess.SubprocessError) as e:
+                raise AdbError(f"adb server 未运行且无法启动: {e}")
+            return socket.create_connection((self.host, self.port), timeout=timeout or self.timeout)
+
+    def host_request(self, request, timeout=None):
+        """发送一个 host:* 请求并返回服务器回复的内容"""
+        with self.open(timeout) as sock:
+            sock.sendall(encode_request(request))
+            read_status(sock)
+            return read_length_prefixed(sock)
+
+    def version(self):
+        return int(self.host_request("host:version"), 16)
+
+    def connect(self, host, port=5555, timeout=None):
+        """相当于 adb connect host:port，返回是否已连接"""
+        message = self.host_request(f"host:connect:{host}:{port}", timeout)
+        return message.startswith(("connected to", "already connected to"))
+
+    def disconnect(self, host, port=5555):
+        try:
+            self.host_request(f"host:disconnect:{host}:{port}")
+        except AdbError:
+            # 未连接的设备会返回 FAIL，与 adb disconnect 一样忽略
+            pass
+
+    def devices(self):
+        """相当于 adb devices，返回 {serial: state}"""
+        return parse_devices(self.host_request("host:devices"))
+
+    def shell(self, serial, command, timeout=None):
+        """在设备上执行 shell 命令，返回输出文本"""
+        with self.open(timeout) as sock:
+            sock.sendall(encode_request(f"host:transport:{serial}"))
+            read_status(sock)
+            sock.sendall(encode_request(f"shell:{command}"))
+            read_status(sock)
+            return recv_until_close(sock).decode('utf-8', errors='replace')
+
+    def getprop(self, serial, name, timeout=None):
+        return self.shell(serial, f"getprop {name}", timeout).strip()
+
+    def getprops(self, serial, timeout=None):
+        """一次 shell 往返取回设备的全部属性"""
+        return parse_getprop(self.shell(serial, "getprop", timeout))
+
+
+class DeviceTracker:
+    """
+    保持一个 host:track-devices 长连接，在后台线程中维护最新的设备列表，
+    查询设备状态时不需要再向 adb server 发请求
+    """
+
+    def __init__(self, client=None):
+        self.client = client or AdbClient()
+        self.devices = {}
+        self.ready = threading.Event()
+        self.running = False
+        self.sock = None
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+    def run(self):
+        while self.running:
+            try:
+                self.sock = self.client.open()
+                self.sock.settimeout(None)
+                self.sock.sendall(encode_request("host:track-devices"))
+                read_status(self.sock)
+                while self.running:
+                    self.devices = parse_devices(read_length_prefixed(self.sock))
+                    self.ready.set()
+            except (OSError, AdbError):
+                # adb server 重启或尚未启动：清空状态，稍后重连
+                self.devices = {}
+                self.ready.clear()
+                if self.running:
+                    time.sleep(1)
+
+    def state(self, serial, timeout=1):
+        """设备状态（device / offline / unauthorized），未知时返回 None"""
+        self.ready.wait(timeout)
+        return self.devices.get(serial)
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """
+    协议兼容的假 adb server，支持 host:version、host:connect、host:disconnect、
+    host:devices、host:track-devices、host:transport 和 shell:getprop。
+
+    targets 为 {"ip:port": 属性字典}，只有其中的地址可以 connect 成功。
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, targets=None, port=0):
+        self.targets = targets or {}
+        self.connected = {}  # serial -> state
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.requests = []  # 收到的请求，便于测试断言
+        super().__init__((ADB_SERVER_HOST, port), FakeAdbHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def devices_text(self):
+        return ''.join(f"{serial}\t{state}\n" for serial, state in self.connected.items())
+
+    def set_connected(self, serial, state):
+        with self.changed:
+            if state is None:
+                self.connected.pop(serial, None)
+            else:
+                self.connected[serial] = state
+            self.changed.notify_all()
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    def send_okay(self, payload=None):
+        data = b'OKAY'
+        if payload is not None:
+            data += encode_request(payload)
+        self.request.sendall(data)
+
+    def send_fail(self, message):
+        self.request.sendall(b'FAIL' + encode_request(message))
+
+    def read_request(self):
+        return read_length_prefixed(self.request)
+
+    def handle(self):
+        server = self.server
+        try:
+            request = self.read_request()
+        except AdbError:
+            return
+        server.requests.append(request)
+
+        if request == "host:version":
+            self.send_okay("0029")
+        elif request.startswith("host:connect:"):
+            serial = request[len("host:connect:"):]
+            if serial in server.connected:
+                self.send_okay(f"already connected to {serial}")
+            elif serial in server.targets:
+                server.set_connected(serial, "device")
+                self.send_okay(f"connected to {serial}")
+            else:
+                self.send_okay(f"failed to connect to '{serial}': Connection refused")
+        elif request.startswith("host:disconnect:"):
+            serial = request[len("host:disconnect:"):]
+            if serial in server.connected:
+                server.set_connected(serial, None)
+                self.send_okay(f"disconnected {serial}")
+            else:
+                self.send_fail(f"no such device '{serial}'")
+        elif request == "host:devices":
+            self.send_okay(server.devices_text())
+        elif request == "host:track-devices":
+            self.send_okay()
+            with server.changed:
+                while True:
+                    text = server.devices_text()
+                    try:
+                        self.request.sendall(encode_request(text))
+                    except OSError:
+                        return
+                    server.changed.wait()
+        elif request.startswith("host:transport:"):
+            serial = request[len("host:transport:"):]
+            if server.connected.get(serial) != "device":
+                self.send_fail(f"device '{serial}' not found")
+                return
+            self.send_okay()
+            self.shell(serial, self.read_request())
+        else:
+            self.send_fail(f"unknown host service '{request}'")
+
+    def shell(self, serial, request):
+        self.server.requests.append(request)
+        props = self.server.targets[serial]
+        command = request[len("shell:"):].split() if request.startswith("shell:") else []
+        if command[:1] != ["getprop"]:
+            self.send_fail(f"unsupported service '{request}'")
+            return
+        self.send_okay()
+        if len(command) > 1:
+            output = f"{props.get(command[1], '')}\n"
+        else:
+            output = ''.join(f"[{name}]: [{value}]\n" for name, value in props.items())
+        self.request.sendall(output.encode('utf-8'))
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) >= 2 and sys.argv[1] == '--fake':
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else ADB_SERVER_PORT
+        fake = FakeAdbServer({
+            "127.0.0.1:5555": {
+                "ro.product.model": "TB-110",
+                "ro.product.manufacturer": "FakeVendor",
+            },
+        }, port=port)
+        print(f"假 adb server 运行在 {ADB_SERVER_HOST}:{fake.port}")
+        fake.serve_forever()
+    else:
+        client = AdbClient()
+        print(f"adb server 版本: {client.version()}")
+        for serial, state in client.devices().items():
+            print(f"{serial}\t{state}")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+设备注册表：记录每个 IP 的设备型号、最近一次发现时间、连接成功/失败次数和响应耗时
+代替只保存 IP 的 ip.txt，数据保存在脚本目录下的 devices.db（SQLite）
+
+- 查询走内存缓存，缓存过期（默认 5 秒）或本进程写入后才重新读取数据库，
+  菜单栏应用等其他进程写入的记录最迟一个 TTL 后可见
+- scan.command 仍然向 ip.txt 追加 IP，文件变化时其中的新 IP 会被导入
+- ranked() 按命中可能性排序，决定扫描时先尝试哪些地址：
+  连接成功过的地址按成功率和最近发现时间计分（7 天衰减一半），
+  DHCP 通常在原地址附近重新分配，所以这些地址附近的地址也按距离得到一部分分数
+"""
+
+import bisect
+import ipaddress
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_FILE = os.path.join(SCRIPT_DIR, "devices.db")
+LEGACY_HISTORY_FILE = os.path.join(SCRIPT_DIR, "ip.txt")
+CACHE_TTL = 5.0
+# 响应耗时取指数移动平均，新样本的权重
+LATENCY_WEIGHT = 0.3
+# 命中记录的权重每隔该时间（秒）减半
+RECENCY_HALF_LIFE = 7 * 86400
+# 从 ip.txt 导入、没有连接记录的地址的权重
+IMPORTED_WEIGHT = 0.2
+# 邻近地址的分数：相距 LOCALITY_SCALE 个地址时降为 1/e，超过 LOCALITY_RANGE 不计
+LOCALITY_WEIGHT = 0.5
+LOCALITY_SCALE = 8
+LOCALITY_RANGE = 64
+
+COLUMNS = ("ip", "model", "manufacturer", "first_seen", "last_seen", "success_count", "failure_count", "latency_ms")
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class DeviceRegistry:
+    def __init__(self, path=REGISTRY_FILE, history_file=LEGACY_HISTORY_FILE, ttl=CACHE_TTL):
+        self.path = path
+        self.history_file = history_file
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS devices (
+                ip TEXT PRIMARY KEY,
+                model TEXT,
+                manufacturer TEXT,
+                first_seen REAL,
+                last_seen REAL,
+                success_count INTEGER NOT NULL DEFAULT 0,
+                failure_count INTEGER NOT NULL DEFAULT 0,
+                latency_ms REAL
+            )
+        """)
+        self.conn.commit()
+        self.cache = {}
+        self.loaded_at = 0.0
+        self.history_mtime = None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def import_history_file(self):
+        """导入 ip.txt 中尚未记录的 IP（文件未变化时不读取）"""
+        try:
+            mtime = os.stat(self.history_file).st_mtime
+        except OSError:
+            return
+        if mtime == self.history_mtime:
+            return
+        with open(self.history_file, 'r') as f:
+            ips = [line.strip() for line in f if line.strip()]
+        self.conn.executemany("INSERT OR IGNORE INTO devices (ip) VALUES (?)", [(ip,) for ip in ips])
+        self.conn.commit()
+        self.history_mtime = mtime
+
+    def records(self):
+        """{ip: 记录字典}，缓存未过期时不访问数据库"""
+        with self.lock:
+            if time.monotonic() - self.loaded_at > self.ttl:
+                try:
+                    self.import_history_file()
+                except (OSError, sqlite3.Error) as e:
+                    print(f"导入 ip.txt 失败: {e}")
+                rows = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM devices").fetchall()
+                self.cache = {row["ip"]: dict(row) for row in rows}
+                self.loaded_at = time.monotonic()
+            return self.cache
+
+    def get(self, ip):
+        return self.records().get(ip)
+
+    def hit_weight(self, record, now):
+        """一条记录的权重：成功次数（取对数）× 成功率 × 时间衰减"""
+        successes, failures = record["success_count"], record["failure_count"]
+        if successes == 0:
+            return IMPORTED_WEIGHT / (1 + failures)
+        recency = 0.5 ** (max(0.0, now - (record["last_seen"] or 0)) / RECENCY_HALF_LIFE)
+        return recency * (1 + math.log(successes)) * successes / (successes + failures)
+
+    def hit_scores(self, ips):
+        """{ip: 分数}，本地址的命中记录计全部权重，附近地址的按距离衰减"""
+        now = time.time()
+        hits = []
+        for ip, record in self.records().items():
+            try:
+                hits.append((int(ipaddress.IPv4Address(ip)), self.hit_weight(record, now)))
+            except ValueError:
+                continue
+        hits.sort()
+        addresses = [address for address, _ in hits]
+        scores = {}
+        for ip in ips:
+            try:
+                address = int(ipaddress.IPv4Address(ip))
+            except ValueError:
+                scores[ip] = 0.0
+                continue
+            score = 0.0
+            lo = bisect.bisect_left(addresses, address - LOCALITY_RANGE)
+            hi = bisect.bisect_right(addresses, address + LOCALITY_RANGE)
+            for hit, weight in hits[lo:hi]:
+                if hit == address:
+                    score += weight
+                else:
+                    score += weight * LOCALITY_WEIGHT * math.exp(-abs(hit - address) / LOCALITY_SCALE)
+            scores[ip] = score
+        return scores
+
+    def ranked(self, ips=None):
+        """按命中可能性从高到低排列；ips 为 None 时返回所有已记录的 IP，否则只排列给定的 IP（分数相同的保持原顺序）"""
+        records = self.records()
+        if ips is None:
+            ips = sorted(records, key=lambda ip: records[ip]["last_seen"] or 0, reverse=True)
+        scores = self.hit_scores(ips)
+        return sorted(ips, key=lambda ip: scores[ip], reverse=True)
+
+    def record_success(self, ip, model=None, manufacturer=None, latency=None):
+        """记录一次成功连接；latency 为秒"""
+        now = time.time()
+        latency_ms = latency * 1000 if latency is not None else None
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO devices (ip, model, manufacturer, first_seen, last_seen, success_count, latency_ms)
+                VALUES (:ip, :model, :manufacturer, :now, :now, 1, :latency)
+                ON CONFLICT(ip) DO UPDATE SET
+                    model = COALESCE(:model, model),
+                    manufacturer = COALESCE(:manufacturer, manufacturer),
+                    first_seen = COALESCE(first_seen, :now),
+                    last_seen = :now,
+                    success_count = success_count + 1,
+                    latency_ms = CASE
+                        WHEN :latency IS NULL THEN latency_ms
+                        WHEN latency_ms IS NULL THEN :latency
+                        ELSE latency_ms * (1 - :weight) + :latency * :weight
+                    END
+            """, {"ip": ip, "model": model, "manufacturer": manufacturer, "now": now,
+                  "latency": latency_ms, "weight": LATENCY_WEIGHT})
+            self.conn.commit()
+            # 下次查询重新读取，保证本进程写入立即可见
+            self.loaded_at = 0.0
+
+    def record_failure(self, ip):
+        """记录一次连接失败；只更新已记录的 IP，扫描到的陌生地址不入库"""
+        with self.lock:
+            self.conn.execute("UPDATE devices SET failure_count = failure_count + 1 WHERE ip = ?", (ip,))
+            self.conn.commit()
+            self.loaded_at = 0.0
+
+    def summary(self):
+        """按排序输出的记录列表，时间转为 ISO 格式，便于 JSON 序列化"""
+        records = self.records()
+        return [
+            dict(records[ip], first_seen=format_time(records[ip]["first_seen"]), last_seen=format_time(records[ip]["last_seen"]))
+            for ip in self.ranked()
+        ]
+
+
+if __name__ == '__main__':
+    for record in DeviceRegistry().summary():
+        print(f"{record['ip']:<16} {record['model'] or '-':<20} 成功 {record['success_count']:<4} "
+              f"失败 {record['failure_count']:<4} 最近 {record['last_seen'] or '-'}")
@@ -14,6 +14,8 @@ from pathlib import Path
 from AppKit import *
 from PyObjCTools import AppHelper
 import objc
+from adb_client import device_summary, parse_getprop
+from device_registry import DeviceRegistry
 
 # 检查是否在macOS上运行
 if sys.platform != 'darwin':
@@ -31,6 +33,8 @@ class ADBMenuBarController(NSObject):
         self.scan_thread = None
         self.device_control_items = []
         self.target_device_name = "110"  # 默认目标设备名
+        # 设备 ID -> 设备信息；设备离线后失效，在线设备刷新时不再重复查询
+        self.device_info_cache = {}
         
         # 获取脚本所在目录
         self.script_dir = Path(__file__).parent
@@ -189,29 +193,30 @@ class ADBMenuBarController(NSObject):
                             'info': device_info
                         })
         
+        # 已断开的设备不再缓存，重新连上时（可能换了设备）重新查询
+        online = {device['id'] for device in self.devices}
+        self.device_info_cache = {device_id: info for device_id, info in self.device_info_cache.items() if device_id in online}
+        
         self.update_device_menu()
         
         # 更新状态栏标题
         self.status_item.setTitle_(f"📱 ({len(self.devices)})")
     
     def get_device_info(self, device_id):
-        """获取设备详细信息"""
+        """获取设备详细信息（一次 getprop 取回全部属性）"""
+        if device_id in self.device_info_cache:
+            return self.device_info_cache[device_id]
+        
         info = {'model': 'Unknown', 'manufacturer': 'Unknown'}
         
         try:
-            # 获取设备型号
-            success, model_output, error = self.run_adb_command(['-s', device_id, 'shell', 'getprop', 'ro.product.model'])
-            if success and model_output.strip():
-                info['model'] = model_output.strip()
-            else:
-                print(f"无法获取设备型号 {device_id}: {error}")
-            
-            # 获取设备制造商
-            success, manufacturer_output, error = self.run_adb_command(['-s', device_id, 'shell', 'getprop', 'ro.product.manufacturer'])
-            if success and manufacturer_output.strip():
-                info['manufacturer'] = manufacturer_output.strip()
+            success, output, error = self.run_adb_command(['-s', device_id, 'shell', 'getprop'])
+            if success and output.strip():
+                # 型号、制造商、SDK、Android 版本、序列号、ABI
+                info.update({key: value for key, value in device_summary(parse_getprop(output)).items() if value})
+                self.device_info_cache[device_id] = info
             else:
-                print(f"无法获取设备制造商 {device_id}: {error}")
+                print(f"无法获取设备属性 {device_id}: {error}")
                 
         except Exception as e:
             print(f"获取设备信息时发生异常 {device_id}: {str(e)}")
@@ -571,20 +576,23 @@ class ADBMenuBarController(NSObject):
                 self.show_notification("设置错误", "目标设备名称不能为空")
     
     def show_history(self):
-        """显示历史记录"""
-        history_file = self.script_dir / 'ip.txt'
-        if not history_file.exists():
-            self.show_alert("暂无历史记录")
-            return
-        
+        """显示历史记录（设备注册表，按命中可能性排序）"""
         try:
-            with open(history_file, 'r') as f:
-                history = f.read().strip().split('\n')
+            registry = DeviceRegistry()
+            history = registry.summary()
+            registry.close()
+            if not history:
+                self.show_alert("暂无历史记录")
+                return
             
             history_text = "历史连接记录:\n\n"
-            for ip in history:
-                if ip.strip():
-                    history_text += f"• {ip.strip()}\n"
+            for record in history:
+                history_text += f"• {record['ip']}"
+                if record['model']:
+                    history_text += f"  {record['model']}"
+                if record['last_seen']:
+                    history_text += f"  (最近 {record['last_seen'][:16].replace('T', ' ')})"
+                history_text += "\n"
             
             self.show_alert(history_text)
         except Exception as e:
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+扫描流程自检：不需要真机和 adb，用 FakeAdbServer 代替 adb server，
+在 127.0.0.1:5555 上开一个本地监听端口代替设备，完整运行 ADBScanner.scan_devices。
+
+    python scan_selftest.py
+
+- 目标设备：型号包含 "110"，应连接成功、启动脚本并记入设备注册表
+- 非目标设备：应连接后断开，扫描结束时不保留连接，也不启动脚本
+
+全部通过时退出码为 0。设备注册表写在临时目录中，不影响 devices.db。
+"""
+
+import os
+import socket
+import sys
+import tempfile
+
+from adb_client import AdbClient, FakeAdbServer
+from device_registry import DeviceRegistry
+import server
+
+DEVICE_IP = "127.0.0.1"
+SERIAL = f"{DEVICE_IP}:{server.ADB_PORT}"
+
+
+class RecordingScanner(server.ADBScanner):
+    """不真正启动 sc/sca/scb 脚本，只记录启动了哪个设备"""
+
+    def __init__(self, *args, **kwargs):
+        self.launched = []
+        super().__init__(*args, **kwargs)
+
+    def launch_target(self, ip):
+        self.launched.append(ip)
+
+
+def run_case(name, model, expect_target, directory):
+    fake = FakeAdbServer({SERIAL: {
+        "ro.product.model": model,
+        "ro.product.manufacturer": "FakeVendor",
+        "ro.build.version.sdk": "33",
+    }}).start()
+    registry = DeviceRegistry(os.path.join(directory, f"{name}.db"), os.path.join(directory, "ip.txt"))
+    scanner = RecordingScanner(sweep_timeout=0.5, adb=AdbClient(port=fake.port),
+                               registry=registry, common_ips=[])
+    stages = []
+    try:
+        scanner.scan_devices(lambda progress, stage, devices: stages.append(stage), [f"{DEVICE_IP}/32"])
+        connected = [device["model"] for device in server.scan_status["connected_devices"]]
+        record = registry.get(DEVICE_IP)
+        if expect_target:
+            checks = {
+                "找到目标设备": connected == [model],
+                "启动了脚本": scanner.launched == [DEVICE_IP],
+                "保持连接": fake.connected.get(SERIAL) == "device",
+                "记入设备注册表": record is not None and record["model"] == model and record["success_count"] == 1,
+            }
+        else:
+            checks = {
+                "没有目标设备": connected == [],
+                "没有启动脚本": scanner.launched == [],
+                "已断开连接": SERIAL not in fake.connected,
+                "提示不是目标设备": any("不是目标设备" in stage for stage in stages),
+            }
+    finally:
+        scanner.tracker.stop()
+        registry.close()
+        fake.stop()
+
+    print(f"[{name}] 型号 {model}")
+    for check, ok in checks.items():
+        print(f"  {'通过' if ok else '失败'}  {check}")
+    if not all(checks.values()):
+        print("  扫描过程:")
+        for stage in stages:
+            print(f"    {stage}")
+    return all(checks.values())
+
+
+def main():
+    # 代替设备的 5555 端口，只需要能接受 TCP 连接
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        listener.bind((DEVICE_IP, server.ADB_PORT))
+    except OSError as e:
+        print(f"无法监听 {SERIAL}（可能有模拟器或设备转发占用了该端口）: {e}")
+        return 2
+    listener.listen(16)
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            results = [
+                run_case("目标设备", "TB-110", True, directory),
+                run_case("非目标设备", "Pixel 7", False, directory),
+            ]
+    finally:
+        listener.close()
+
+    print("全部通过" if all(results) else "存在失败项")
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,16 +9,21 @@ import threading
 import json
 import time
 import socket
+import selectors
+import errno
 import re
 import os
 import ipaddress
+import itertools
 import tempfile
 from datetime import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 from socketserver import ThreadingMixIn
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from adb_client import AdbClient, AdbError, DeviceTracker, device_summary
+from device_registry import DeviceRegistry
 
 # 全局变量
 scan_status = {
@@ -32,21 +37,167 @@ scan_status = {
 }
 
 # 配置
-IP_HISTORY_FILE = os.path.join(os.path.dirname(__file__), "ip.txt")
 ADB_PORT = 5555
-MAX_WORKERS = 50
+# 非阻塞端口扫描：同时进行的连接数（macOS 默认文件描述符上限为 256）与单个连接超时（秒）
+SWEEP_CONCURRENCY = int(os.environ.get("ADB_SWEEP_CONCURRENCY", "200"))
+SWEEP_TIMEOUT = float(os.environ.get("ADB_SWEEP_TIMEOUT", "1.0"))
+# 网卡网段大于该前缀（如 /16）时，只扫描本机所在的这一段，避免一次扫描数万个地址
+SCAN_MIN_PREFIX = int(os.environ.get("ADB_SCAN_MIN_PREFIX", "20"))
+# 手动指定的网段最多包含的地址数（默认与 SCAN_MIN_PREFIX 的网段大小相同），超过时拒绝扫描
+SCAN_MAX_ADDRESSES = int(os.environ.get("ADB_SCAN_MAX_ADDRESSES", str(2 ** (32 - SCAN_MIN_PREFIX))))
+# 扫描时把网段切分为该大小的分片，分别统计进度
+SHARD_PREFIX = 24
+# 目标设备：型号中包含该字符串
+TARGET_MODEL = "110"
+# 并发探测历史 IP 时，同时进行的 ADB 连接数
+PROBE_WORKERS = 16
+# 常见IP列表，历史 IP 和网段扫描都找不到目标设备时尝试
+COMMON_IPS = ["172.16.128.1", "172.16.128.2", "172.16.128.100", "172.16.128.200"]
+
+
+def get_local_networks():
+    """获取所有网卡上的内网 IPv4 地址及其网段（ipaddress.IPv4Interface 列表）"""
+    try:
+        result = subprocess.run(['ifconfig'], capture_output=True, text=True)
+    except Exception as e:
+        print(f"获取网卡信息失败: {e}")
+        return []
+    interfaces = []
+    # macOS: "inet 192.168.1.5 netmask 0xffffff00"；Linux: "inet 10.0.0.2  netmask 255.255.255.0"
+    for ip, mask in re.findall(r'inet (\d+\.\d+\.\d+\.\d+)\s+netmask\s+(0x[0-9a-fA-F]+|\d+\.\d+\.\d+\.\d+)', result.stdout):
+        if mask.startswith('0x'):
+            mask = str(ipaddress.IPv4Address(int(mask, 16)))
+        try:
+            interface = ipaddress.IPv4Interface(f"{ip}/{mask}")
+        except ValueError:
+            continue
+        if interface.ip.is_private and not interface.ip.is_loopback and not interface.ip.is_link_local:
+            if interface.network.prefixlen < SCAN_MIN_PREFIX:
+                interface = ipaddress.IPv4Interface(f"{ip}/{SCAN_MIN_PREFIX}")
+            if interface not in interfaces:
+                interfaces.append(interface)
+    return interfaces
+
+
+def parse_networks(cidrs):
+    """
+    把 CIDR 字符串（也可以是单个 IP）解析为 IPv4 网段列表，重叠部分合并。
+    地址总数超过 SCAN_MAX_ADDRESSES 时抛出 ValueError，避免一次生成数百万个地址。
+    """
+    if isinstance(cidrs, str):
+        cidrs = re.split(r'[,\s]+', cidrs)
+    # 来自 JSON 请求体时可能是数字、对象等，统一报 ValueError 由调用方返回 400
+    if not isinstance(cidrs, (list, tuple)) or not all(isinstance(cidr, str) for cidr in cidrs):
+        raise ValueError(f"网段必须是字符串或字符串列表: {cidrs!r}")
+    networks = [ipaddress.IPv4Network(cidr.strip(), strict=False) for cidr in cidrs if cidr and cidr.strip()]
+    networks = list(ipaddress.collapse_addresses(networks))
+    total = sum(network.num_addresses for network in networks)
+    if total > SCAN_MAX_ADDRESSES:
+        raise ValueError(f"网段共 {total} 个地址，超过上限 {SCAN_MAX_ADDRESSES}（可通过 ADB_SCAN_MAX_ADDRESSES 调整）")
+    return networks
+
+
+def shard_network(network):
+    """把网段切分为 SHARD_PREFIX 大小的分片，返回 [(分片, 主机地址列表)]；不包含整个网段的网络地址和广播地址"""
+    if network.prefixlen >= 31:
+        return [(network, [str(ip) for ip in network])]
+    shards = network.subnets(new_prefix=SHARD_PREFIX) if network.prefixlen < SHARD_PREFIX else [network]
+    excluded = (network.network_address, network.broadcast_address)
+    return [(shard, [str(ip) for ip in shard if ip not in excluded]) for shard in shards]
+
+
+def tcp_sweep(ips, port=ADB_PORT, concurrency=SWEEP_CONCURRENCY, timeout=SWEEP_TIMEOUT, on_result=None, stop=None):
+    """
+    用 selectors 同时对多个 IP 发起非阻塞 TCP 连接，返回端口开放的 IP 列表（按响应先后排序）。
+    拒绝连接的地址立即结束，无响应的地址在 timeout 秒后放弃，
+    因此整段扫描耗时约为 (地址数 / concurrency) 个超时。
+    on_result(ip, is_open) 在每个地址得出结果时调用。
+    stop 为 threading.Event，设置后在 0.1 秒内放弃其余地址。
+    """
+    if concurrency < 1:
+        raise ValueError(f"并发连接数必须大于 0: {concurrency}")
+    if timeout <= 0:
+        raise ValueError(f"连接超时必须大于 0: {timeout}")
+    pending = list(ips)
+    pending.reverse()  # 从末尾弹出，保持原有顺序
+    in_flight = {}  # socket -> (ip, 截止时间)
+    open_ips = []
+    selector = selectors.DefaultSelector()
+
+    def finish(sock, ip, is_open):
+        if sock in in_flight:
+            selector.unregister(sock)
+            del in_flight[sock]
+        sock.close()
+        if is_open:
+            open_ips.append(ip)
+        if on_result:
+            on_result(ip, is_open)
+
+    try:
+        while (pending or in_flight) and not (stop and stop.is_set()):
+            # 补满并发窗口
+            while pending and len(in_flight) < concurrency:
+                ip = pending.pop()
+                try:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                except OSError as e:
+                    if e.errno in (errno.EMFILE, errno.ENFILE) and in_flight:
+                        # 文件描述符用尽：等已有连接结束后再试
+                        pending.append(ip)
+                        break
+                    raise
+                sock.setblocking(False)
+                err = sock.connect_ex((ip, port))
+                if err == 0:
+                    finish(sock, ip, True)
+                elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    in_flight[sock] = (ip, time.monotonic() + timeout)
+                else:
+                    finish(sock, ip, False)
+
+            if not in_flight:
+                continue
+            wait = max(0.0, min(deadline for _, deadline in in_flight.values()) - time.monotonic())
+            if stop:
+                wait = min(wait, 0.1)
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                ip = in_flight[sock][0]
+                finish(sock, ip, sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0)
+
+            now = time.monotonic()
+            for sock, (ip, deadline) in list(in_flight.items()):
+                if deadline <= now:
+                    finish(sock, ip, False)
+    finally:
+        for sock in list(in_flight):
+            selector.unregister(sock)
+            sock.close()
+        selector.close()
+
+    return open_ips
 
 class ADBScanner:
-    def __init__(self):
-        self.ip_history_file = IP_HISTORY_FILE
+    def __init__(self, sweep_concurrency=SWEEP_CONCURRENCY, sweep_timeout=SWEEP_TIMEOUT,
+                 adb=None, registry=None, common_ips=COMMON_IPS):
+        # 历史设备记录（型号、最近发现时间、成功次数、响应耗时），决定历史 IP 的尝试顺序
+        self.registry = registry or DeviceRegistry()
+        self.common_ips = common_ips
+        self.sweep_concurrency = sweep_concurrency
+        self.sweep_timeout = sweep_timeout
+        # 通过 smart-socket 协议直接与 adb server 通信，不再为每个操作启动 adb 进程
+        self.adb = adb or AdbClient()
         self.ensure_adb_running()
+        # host:track-devices 长连接，/devices 直接读取它维护的设备列表
+        self.tracker = DeviceTracker(self.adb).start()
         
     def ensure_adb_running(self):
-        """确保 ADB 服务正在运行"""
+        """确保 ADB 服务正在运行（未运行时 AdbClient 会执行一次 adb start-server）"""
         try:
-            subprocess.run(['adb', 'start-server'], check=True, capture_output=True)
-            time.sleep(1)
-        except subprocess.CalledProcessError:
+            self.adb.version()
+        except (OSError, AdbError):
             print("ADB 启动失败，请确保已安装 Android SDK Platform Tools")
     
     def get_local_ip(self):
@@ -69,59 +220,38 @@ class ADBScanner:
             print(f"获取本地IP失败: {e}")
             return None
     
-    def ping_ip(self, ip):
-        """检测 IP 是否在线"""
-        try:
-            result = subprocess.run(['ping', '-c', '1', '-W', '1', ip], 
-                                  capture_output=True, timeout=2)
-            return result.returncode == 0
-        except:
-            return False
-    
-    def check_port(self, ip, port=ADB_PORT):
-        """检测端口是否开放"""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(2)
-                result = s.connect_ex((ip, port))
-                return result == 0
-        except:
-            return False
-    
     def adb_connect(self, ip):
         """ADB 连接设备"""
         try:
-            result = subprocess.run(['adb', 'connect', f'{ip}:{ADB_PORT}'], 
-                                  capture_output=True, text=True, timeout=5)
-            return 'connected' in result.stdout.lower()
-        except:
+            return self.adb.connect(ip, ADB_PORT, timeout=5)
+        except (OSError, AdbError):
             return False
     
     def adb_disconnect(self, ip):
         """ADB 断开设备"""
         try:
-            subprocess.run(['adb', 'disconnect', f'{ip}:{ADB_PORT}'], 
-                          capture_output=True, timeout=3)
-        except:
+            self.adb.disconnect(ip, ADB_PORT)
+        except (OSError, AdbError):
             pass
     
+    def is_adb_device(self, ip):
+        """设备是否已连接且处于 device 状态（不含 offline / unauthorized）"""
+        try:
+            return self.adb.devices().get(f'{ip}:{ADB_PORT}') == 'device'
+        except (OSError, AdbError):
+            return False
+    
     def get_device_info(self, ip):
         """获取设备信息"""
         try:
-            # 获取设备型号
-            model = subprocess.run(['adb', '-s', f'{ip}:{ADB_PORT}', 'shell', 'getprop', 'ro.product.model'], 
-                                 capture_output=True, text=True, timeout=3)
-            model_name = model.stdout.strip() if model.returncode == 0 else "Unknown"
-            
-            # 获取设备制造商
-            manufacturer = subprocess.run(['adb', '-s', f'{ip}:{ADB_PORT}', 'shell', 'getprop', 'ro.product.manufacturer'], 
-                                       capture_output=True, text=True, timeout=3)
-            manufacturer_name = manufacturer.stdout.strip() if manufacturer.returncode == 0 else "Unknown"
+            # 一次 getprop 取回全部属性，再从中取型号、制造商、SDK、序列号和 ABI
+            summary = device_summary(self.adb.getprops(f'{ip}:{ADB_PORT}', timeout=3))
             
             return {
                 "ip": ip,
-                "model": model_name,
-                "manufacturer": manufacturer_name,
+                **summary,
+                "model": summary["model"] or "Unknown",
+                "manufacturer": summary["manufacturer"] or "Unknown",
                 "connected": True,
                 "last_seen": datetime.now().isoformat()
             }
@@ -135,45 +265,40 @@ class ADBScanner:
             }
     
     def load_history_ips(self):
-        """加载历史 IP 地址"""
-        if os.path.exists(self.ip_history_file):
-            try:
-                with open(self.ip_history_file, 'r') as f:
-                    return [line.strip() for line in f.readlines() if line.strip()]
-            except:
-                return []
-        return []
+        """历史 IP 地址，按命中可能性从高到低排列"""
+        return self.registry.ranked()
     
-    def save_history_ip(self, ip):
-        """保存 IP 到历史记录"""
+    def save_history_ip(self, ip, device_info=None, latency=None):
+        """记录一次成功连接（型号、制造商、连接耗时）"""
+        # 取不到的属性显示为 "Unknown"，不覆盖已记录的值
+        known = {key: value for key, value in (device_info or {}).items() if value and not str(value).startswith("Unknown")}
         try:
-            existing_ips = self.load_history_ips()
-            if ip not in existing_ips:
-                existing_ips.append(ip)
-                with open(self.ip_history_file, 'w') as f:
-                    f.write('\n'.join(existing_ips))
-        except:
-            pass
+            self.registry.record_success(ip, known.get("model"), known.get("manufacturer"), latency)
+        except Exception as e:
+            print(f"保存设备记录失败 {ip}: {e}")
     
     def direct_connect_attempt(self, ip, callback=None):
-        """直接连接尝试 - 模拟 scan.command 的逻辑"""
-        if callback:
-            callback(0, f"尝试直接连接: {ip}:5555", [])
-        
-        # 检查端口是否开放
-        if not self.check_port(ip):
-            if callback:
-                callback(0, f"端口未开放: {ip}", [])
-            return None
-        
+        """对端口已开放的地址尝试 ADB 连接 - 模拟 scan.command 的逻辑；结果记入设备注册表"""
+        started = time.monotonic()
+        device_info = self.try_connect(ip, callback)
+        try:
+            if device_info:
+                self.save_history_ip(ip, device_info, time.monotonic() - started)
+            else:
+                self.registry.record_failure(ip)
+        except Exception as e:
+            print(f"保存设备记录失败 {ip}: {e}")
+        return device_info
+    
+    def try_connect(self, ip, callback=None):
+        # 端口已由 tcp_sweep 确认开放
         if callback:
             callback(0, f"端口开放，尝试ADB连接: {ip}", [])
         
         # 尝试ADB连接
         if self.adb_connect(ip):
             # 检查是否连接成功
-            devices_result = subprocess.run(['adb', 'devices'], capture_output=True, text=True)
-            if f'{ip}:5555' in devices_result.stdout and 'device' in devices_result.stdout:
+            if self.is_adb_device(ip):
                 device_info = self.get_device_info(ip)
                 if callback:
                     callback(0, f"成功连接到设备: {ip}", [device_info])
@@ -185,212 +310,244 @@ class ADBScanner:
             callback(0, f"ADB连接失败: {ip}", [])
         return None
     
-    def fast_ping_scan(self, subnet, callback=None):
-        """快速ping扫描 - 模拟 scan.command 的逻辑"""
-        active_ips = []
-        total_ips = 254
+    def is_target(self, device_info):
+        """检查是否为目标设备（型号包含110）"""
+        return TARGET_MODEL in device_info["model"]
+    
+    def launch_target(self, ip):
+        """自动启动相关脚本"""
+        try:
+            subprocess.Popen(['zsh', '-c', f'sc {ip}'])
+            time.sleep(2)
+            subprocess.Popen(['zsh', '-c', f'sca {ip}'])
+            time.sleep(2)
+            subprocess.Popen(['zsh', '-c', f'scb {ip}'])
+        except:
+            pass
+    
+    def probe_candidates(self, ips, callback=None, progress=0):
+        """
+        并发探测一组候选 IP（历史 IP、常见 IP），返回找到的目标设备信息，未找到时返回 None。
+        所有地址同时做非阻塞端口检查，总耗时约为一个端口超时加一次 ADB 连接，而不是每个地址依次等待。
+        """
+        def sweep(on_open, stop):
+            def on_result(ip, is_open):
+                if is_open:
+                    on_open(ip)
+                else:
+                    # 端口不通的历史 IP 计一次失败，降低以后的排序
+                    self.registry.record_failure(ip)
+            
+            tcp_sweep(self.registry.ranked(ips), ADB_PORT, self.sweep_concurrency, self.sweep_timeout, on_result, stop=stop)
+        
+        return self.find_target(sweep, callback, progress)
+    
+    def find_target(self, sweep, callback=None, progress=0):
+        """
+        sweep(on_open, stop) 做端口扫描，每发现一个开放的地址就调用 on_open(ip)。
+        端口开放的地址立即在线程池中尝试 ADB 连接，不等扫描结束；
+        找到目标设备后设置 stop 结束扫描并取消尚未开始的连接，不是目标的设备断开连接。
+        已经开始的连接（受连接超时限制）结束后才返回，之后不再调用 callback，
+        不会覆盖扫描状态，也不会与下一阶段或下一次扫描重叠。
+        返回目标设备信息，未找到时返回 None。
+        """
+        found = threading.Event()
+        lock = threading.Lock()
+        target = []
+        executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+        futures = []
+        
+        def report(*args):
+            # 找到目标设备后其余连接的进度不再上报
+            if callback and not found.is_set():
+                callback(*args)
+        
+        def connect(ip):
+            if found.is_set():
+                return
+            device_info = self.direct_connect_attempt(ip, report)
+            if not device_info:
+                return
+            if self.is_target(device_info):
+                with lock:
+                    if not found.is_set():
+                        target.append(device_info)
+                        found.set()
+                        return
+            else:
+                report(progress, f"不是目标设备，断开连接: {ip}", [])
+            self.adb_disconnect(ip)
+        
+        def on_open(ip):
+            if not found.is_set():
+                futures.append(executor.submit(connect, ip))
+        
+        try:
+            sweep(on_open, found)
+            # 等到找到目标设备或所有连接尝试结束
+            pending = set(futures)
+            while pending and not found.is_set():
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        finally:
+            # 取消尚未开始的连接，等待已经开始的结束
+            executor.shutdown(wait=True, cancel_futures=True)
+        
+        return target[0] if target else None
+    
+    def sweep_networks(self, networks, callback=None, on_open=None, stop=None):
+        """
+        扫描任意多个网段的 5555 端口。所有网段切分为 /24 分片后交错排列，
+        再按设备注册表的命中可能性排序（历史设备地址及其附近的地址最先扫描），
+        共用同一个并发扫描器，进度按分片记录在 scan_status["shards"] 中。
+        on_open(ip) 在每个端口开放的地址得出结果时立即调用；stop 为 threading.Event，设置后停止扫描。
+        """
+        shards = [shard for network in networks for shard in shard_network(network)]
+        shard_status = {
+            str(shard): {"scanned": 0, "total": len(ips), "open": []}
+            for shard, ips in shards
+        }
+        scan_status["shards"] = shard_status
+        shard_of = {}
+        for shard, ips in shards:
+            for ip in ips:
+                shard_of[ip] = str(shard)
+        # 轮流从各分片取地址，所有分片同时推进；命中可能性高的地址排在最前
+        ips = [ip for group in itertools.zip_longest(*(ips for _, ips in shards)) for ip in group if ip]
+        ips = self.registry.ranked(ips)
+        total = len(ips)
         scanned = 0
+        open_ports = []
         
         if callback:
-            callback(0, "执行快速ping扫描...", [])
+            callback(0, f"扫描 {', '.join(str(n) for n in networks)}：{len(shards)} 个分片，{total} 个地址 "
+                        f"(并发 {self.sweep_concurrency}, 超时 {self.sweep_timeout}s)", [])
         
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = []
-            for i in range(1, 255):
-                ip = f"{subnet}.{i}"
-                future = executor.submit(self.ping_ip, ip)
-                futures.append((future, ip))
-            
-            for future, ip in futures:
-                try:
-                    if future.result():
-                        active_ips.append(ip)
-                except:
-                    pass
-                
-                scanned += 1
-                progress = int((scanned / total_ips) * 30)  # ping扫描占30%
-                if callback:
-                    callback(progress, f"正在扫描 {subnet}.x 网段 ({scanned}/{total_ips})", active_ips)
+        def on_result(ip, is_open):
+            nonlocal scanned
+            scanned += 1
+            status = shard_status[shard_of[ip]]
+            status["scanned"] += 1
+            if is_open:
+                open_ports.append(ip)
+                status["open"].append(ip)
+                if on_open:
+                    on_open(ip)
+            if callback and (is_open or status["scanned"] == status["total"]):
+                progress = int((scanned / total) * 70)  # 端口扫描占70%
+                callback(progress, f"分片 {shard_of[ip]}: {status['scanned']}/{status['total']}，"
+                                   f"开放 {len(status['open'])} 个 (总计 {scanned}/{total})", list(open_ports))
+        
+        if total:
+            tcp_sweep(ips, ADB_PORT, self.sweep_concurrency, self.sweep_timeout, on_result, stop)
         
         if callback:
-            callback(30, f"发现 {len(active_ips)} 个活跃设备", active_ips)
+            callback(70, f"发现 {len(open_ports)} 个开放{ADB_PORT}端口的设备", open_ports)
         
-        return active_ips
+        return open_ports
     
-    def fast_port_scan(self, ips, callback=None):
-        """快速端口扫描 - 模拟 scan.command 的逻辑"""
-        open_ports = []
+    def fast_port_scan(self, ips, callback=None, message=None):
+        """快速端口扫描：所有地址同时发起非阻塞连接，耗时约为一个连接超时"""
         total = len(ips)
         scanned = 0
+        open_ports = []
         
         if callback:
-            callback(30, "快速扫描5555端口...", [])
+            callback(0, f"快速扫描{ADB_PORT}端口 (并发 {self.sweep_concurrency}, 超时 {self.sweep_timeout}s)...", [])
         
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = []
-            for ip in ips:
-                future = executor.submit(self.check_port, ip)
-                futures.append((future, ip))
-            
-            for future, ip in futures:
-                try:
-                    if future.result():
-                        open_ports.append(ip)
-                except:
-                    pass
-                
-                scanned += 1
-                progress = 30 + int((scanned / total) * 40)  # 端口扫描占40%
-                if callback:
-                    callback(progress, f"正在扫描 {ADB_PORT} 端口 ({scanned}/{total})", open_ports)
+        def on_result(ip, is_open):
+            nonlocal scanned
+            scanned += 1
+            if is_open:
+                open_ports.append(ip)
+            if callback and (is_open or scanned % 16 == 0 or scanned == total):
+                progress = int((scanned / total) * 70)  # 端口扫描占70%
+                callback(progress, f"{message or f'正在扫描 {ADB_PORT} 端口'} ({scanned}/{total})", list(open_ports))
+        
+        if total:
+            tcp_sweep(ips, ADB_PORT, self.sweep_concurrency, self.sweep_timeout, on_result)
         
         if callback:
-            callback(70, f"发现 {len(open_ports)} 个开放5555端口的设备", open_ports)
+            callback(70, f"发现 {len(open_ports)} 个开放{ADB_PORT}端口的设备", open_ports)
         
         return open_ports
     
-    def scan_devices(self, callback=None):
-        """主扫描函数 - 完全模拟 scan.command 的逻辑"""
+    def get_scan_networks(self, cidrs=None):
+        """要扫描的网段：指定了 CIDR 就用指定的，否则为所有网卡所在的网段"""
+        if cidrs:
+            return parse_networks(cidrs)
+        networks = [interface.network for interface in get_local_networks()]
+        if not networks:
+            # 取不到网卡掩码时回退到本机 IP 所在的 /24
+            local_ip = self.get_local_ip()
+            if local_ip:
+                networks = [ipaddress.IPv4Network(f"{local_ip}/24", strict=False)]
+        return list(ipaddress.collapse_addresses(networks))
+    
+    def scan_devices(self, callback=None, cidrs=None):
+        """主扫描函数 - 完全模拟 scan.command 的逻辑；cidrs 为要扫描的网段，默认为所有网卡所在网段"""
         scan_status["is_scanning"] = True
         scan_status["start_time"] = datetime.now().isoformat()
         scan_status["found_devices"] = []
         scan_status["connected_devices"] = []
+        scan_status["shards"] = {}
         
         try:
-            # 获取本地 IP
-            local_ip = self.get_local_ip()
-            if not local_ip:
+            networks = self.get_scan_networks(cidrs)
+            if not networks:
                 raise Exception("无法获取本地 IP 地址")
             
-            subnet = '.'.join(local_ip.split('.')[:3])
-            
             if callback:
-                callback(0, f"本机IP地址: {local_ip}", [])
-                callback(0, f"当前网段: {subnet}", [])
+                callback(0, f"扫描网段: {', '.join(str(network) for network in networks)}", [])
             
-            # 优先尝试历史 IP
-            history_ips = self.load_history_ips()
+            # 优先尝试历史 IP：同网段的历史 IP 同时探测，找到目标设备即停止
+            history_ips = []
+            for ip in self.load_history_ips():
+                try:
+                    if any(ipaddress.IPv4Address(ip) in network for network in networks):
+                        history_ips.append(ip)
+                except ValueError:
+                    continue
             if history_ips:
                 if callback:
-                    callback(0, "发现历史IP记录，优先尝试连接...", [])
+                    callback(0, f"发现 {len(history_ips)} 个同网段历史IP，并发尝试连接...", [])
                 
-                connected = False
-                for ip in history_ips:
-                    ip_subnet = '.'.join(ip.split('.')[:3])
-                    if ip_subnet == subnet:
-                        if callback:
-                            callback(0, f"尝试连接同网段历史IP: {ip}", [])
-                        
-                        device_info = self.direct_connect_attempt(ip, callback)
-                        if device_info:
-                            scan_status["connected_devices"].append(device_info)
-                            if callback:
-                                callback(100, f"成功连接到历史设备: {ip}", [device_info])
-                            
-                            # 检查是否为目标设备（包含110）
-                            if "110" in device_info["model"]:
-                                if callback:
-                                    callback(100, "找到目标设备！", [device_info])
-                                
-                                # 自动启动相关脚本
-                                try:
-                                    subprocess.Popen(['zsh', '-c', f'sc {ip}'])
-                                    time.sleep(2)
-                                    subprocess.Popen(['zsh', '-c', f'sca {ip}'])
-                                    time.sleep(2)
-                                    subprocess.Popen(['zsh', '-c', f'scb {ip}'])
-                                except:
-                                    pass
-                            
-                            connected = True
-                            break
-                
-                if connected:
+                device_info = self.probe_candidates(history_ips, callback, 0)
+                if device_info:
+                    scan_status["connected_devices"].append(device_info)
                     scan_status["found_devices"] = scan_status["connected_devices"]
+                    if callback:
+                        callback(100, f"找到目标设备！成功连接到历史设备: {device_info['ip']}", [device_info])
+                    self.launch_target(device_info["ip"])
                     return
             
             if callback:
-                callback(0, "无法连接到任何历史IP，开始快速扫描...", [])
+                callback(0, "历史IP中没有目标设备，开始快速扫描...", [])
             
-            # 方法1: 快速ping扫描 + 端口扫描
+            # 方法1: 所有网段的 5555 端口并发扫描（不再逐个 ping）
             if callback:
-                callback(0, "=== 方法1: 快速ping扫描 + 端口扫描 ===", [])
-            
-            active_ips = self.fast_ping_scan(subnet, callback)
+                callback(0, "=== 方法1: 网段端口扫描 ===", [])
             
-            if active_ips:
-                open_ports = self.fast_port_scan(active_ips, callback)
-                
-                if open_ports:
-                    if callback:
-                        callback(70, "正在连接设备...", [])
-                    
-                    for ip in open_ports:
-                        device_info = self.direct_connect_attempt(ip, callback)
-                        if device_info:
-                            scan_status["connected_devices"].append(device_info)
-                            self.save_history_ip(ip)
-                            
-                            # 检查是否为目标设备（包含110）
-                            if "110" in device_info["model"]:
-                                if callback:
-                                    callback(100, "找到目标设备！", [device_info])
-                                
-                                # 自动启动相关脚本
-                                try:
-                                    subprocess.Popen(['zsh', '-c', f'sc {ip}'])
-                                    time.sleep(2)
-                                    subprocess.Popen(['zsh', '-c', f'sca {ip}'])
-                                    time.sleep(2)
-                                    subprocess.Popen(['zsh', '-c', f'scb {ip}'])
-                                except:
-                                    pass
-                                
-                                break
-                            else:
-                                if callback:
-                                    callback(70, "不是目标设备，断开连接", [])
-                                self.adb_disconnect(ip)
-            
-            # 方法2: 超快速端口扫描 (直接扫描常见IP)
+            # 按命中可能性排序扫描，端口一开放就尝试连接，找到目标设备即停止扫描
+            device_info = self.find_target(
+                lambda on_open, stop: self.sweep_networks(networks, callback, on_open, stop), callback, 70)
+            if device_info:
+                scan_status["connected_devices"].append(device_info)
+                if callback:
+                    callback(100, "找到目标设备！", [device_info])
+                self.launch_target(device_info["ip"])
+        
+            # 方法2: 超快速端口扫描 (同时探测常见IP)
             if not scan_status["connected_devices"]:
                 if callback:
                     callback(70, "=== 方法2: 超快速端口扫描 ===", [])
-                    callback(70, "直接扫描常见IP地址...", [])
+                    callback(70, f"同时扫描常见IP地址: {', '.join(self.common_ips)}", [])
                 
-                # 常见IP列表
-                common_ips = ["172.16.128.1", "172.16.128.2", "172.16.128.100", "172.16.128.200"]
-                
-                for ip in common_ips:
+                device_info = self.probe_candidates(self.common_ips, callback, 70)
+                if device_info:
                     if callback:
-                        callback(70, f"扫描: {ip}", [])
-                    
-                    device_info = self.direct_connect_attempt(ip, callback)
-                    if device_info:
-                        # 检查是否为目标设备（包含110）
-                        if "110" in device_info["model"]:
-                            if callback:
-                                callback(100, "找到目标设备！", [device_info])
-                            
-                            self.save_history_ip(ip)
-                            
-                            # 自动启动相关脚本
-                            try:
-                                subprocess.Popen(['zsh', '-c', f'sc {ip}'])
-                                time.sleep(2)
-                                subprocess.Popen(['zsh', '-c', f'sca {ip}'])
-                                time.sleep(2)
-                                subprocess.Popen(['zsh', '-c', f'scb {ip}'])
-                            except:
-                                pass
-                            
-                            scan_status["connected_devices"].append(device_info)
-                            break
-                        else:
-                            if callback:
-                                callback(70, "不是目标设备，断开连接", [])
-                            self.adb_disconnect(ip)
+                        callback(100, "找到目标设备！", [device_info])
+                    self.launch_target(device_info["ip"])
+                    scan_status["connected_devices"].append(device_info)
             
             scan_status["found_devices"] = scan_status["connected_devices"]
             
@@ -412,83 +569,52 @@ class ADBDeviceManager:
     def __init__(self):
         self.timeout = 3
         self.devices = []
-        self.ip_history_file = os.path.join(os.path.dirname(__file__), 'ip.txt')
         self.scanner = ADBScanner()
         
-    def scan_devices(self):
-        """扫描局域网内的ADB设备 - 简化版本"""
+    def scan_devices(self, cidrs=None):
+        """扫描局域网内的ADB设备 - 简化版本；默认扫描所有网卡所在网段的全部地址"""
         try:
             # 确保ADB服务运行
-            subprocess.run(['adb', 'start-server'], capture_output=True, timeout=5)
+            self.scanner.ensure_adb_running()
             
-            # 获取本地IP
-            result = subprocess.run(['ifconfig'], capture_output=True, text=True)
-            local_ip_match = re.search(r'inet (192\.168\.\d+\.\d+|10\.\d+\.\d+\.\d+|172\.(1[6-9]|2[0-9]|3[01])\.\d+\.\d+)', result.stdout)
-            
-            if not local_ip_match:
+            networks = self.scanner.get_scan_networks(cidrs)
+            if not networks:
                 return {"success": False, "error": "无法获取本地IP地址"}
             
-            local_ip = local_ip_match.group(1)
-            subnet = '.'.join(local_ip.split('.')[:3])
-            
-            # 扫描当前网段的常见IP地址
             devices = []
-            common_ips = [f"{subnet}.{i}" for i in range(100, 200)]  # 扫描100-199范围
-            
-            for ip in common_ips:
+            # 先并发扫描端口，只对开放 5555 的地址做 ADB 连接
+            for ip in self.scanner.sweep_networks(networks):
                 try:
-                    # 检查端口是否开放
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                        s.settimeout(1)
-                        if s.connect_ex((ip, 5555)) == 0:
-                            # 尝试ADB连接
-                            connect_result = subprocess.run(
-                                ['adb', 'connect', f'{ip}:5555'],
-                                capture_output=True, text=True, timeout=3
-                            )
-                            
-                            if 'connected' in connect_result.stdout.lower():
-                                # 获取设备名称
-                                name_result = subprocess.run(
-                                    ['adb', '-s', f'{ip}:5555', 'shell', 'getprop', 'ro.product.model'],
-                                    capture_output=True, text=True, timeout=3
-                                )
-                                
-                                device_name = name_result.stdout.strip() if name_result.returncode == 0 else "Unknown Device"
-                                
-                                devices.append({
-                                    'ip': ip,
-                                    'name': device_name,
-                                    'connected': False
-                                })
-                                
-                                # 断开连接
-                                subprocess.run(['adb', 'disconnect', f'{ip}:5555'], capture_output=True)
-                                
-                except (subprocess.TimeoutExpired, socket.timeout, Exception):
+                    # 尝试ADB连接
+                    started = time.monotonic()
+                    if self.scanner.adb.connect(ip, 5555, timeout=3):
+                        # 获取设备名称
+                        device_name = self.scanner.adb.getprop(f'{ip}:5555', 'ro.product.model', timeout=3) or "Unknown Device"
+                        self.scanner.save_history_ip(ip, {"model": device_name}, time.monotonic() - started)
+                        
+                        devices.append({
+                            'ip': ip,
+                            'name': device_name,
+                            'connected': False
+                        })
+                        
+                        # 断开连接
+                        self.scanner.adb.disconnect(ip, 5555)
+                        
+                except (socket.timeout, Exception):
                     continue
             
             # 如果没有找到设备，尝试历史IP
-            if not devices and os.path.exists(self.ip_history_file):
-                try:
-                    with open(self.ip_history_file, 'r') as f:
-                        for line in f:
-                            ip = line.strip()
-                            if ip and self.is_valid_ip(ip):
-                                try:
-                                    # 检查历史IP
-                                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                                        s.settimeout(2)
-                                        if s.connect_ex((ip, 5555)) == 0:
-                                            devices.append({
-                                                'ip': ip,
-                                                'name': 'Historical Device',
-                                                'connected': False
-                                            })
-                                except:
-                                    continue
-                except:
-                    pass
+            if not devices:
+                # 历史IP一起做一次端口扫描
+                history = self.scanner.registry.records()
+                history_ips = [ip for ip in self.scanner.load_history_ips() if self.is_valid_ip(ip)]
+                for ip in self.scanner.fast_port_scan(history_ips):
+                    devices.append({
+                        'ip': ip,
+                        'name': history[ip]["model"] or 'Historical Device',
+                        'connected': False
+                    })
             
             return {"success": True, "devices": devices}
             
@@ -516,81 +642,50 @@ class ADBDeviceManager:
         return None
     
     def scan_historical_ips(self):
-        """扫描历史IP地址"""
+        """扫描历史IP地址：先一起做一次端口扫描，只对开放 5555 的地址做 ADB 检查"""
         devices = []
+        history_ips = [ip for ip in self.scanner.load_history_ips() if self.is_valid_ip(ip)]
+        open_ips = set(self.scanner.fast_port_scan(history_ips))
         
-        if os.path.exists(self.ip_history_file):
-            with open(self.ip_history_file, 'r') as f:
-                for line in f:
-                    ip = line.strip()
-                    if ip and self.is_valid_ip(ip):
-                        device_info = self.check_device(ip)
-                        if device_info:
-                            devices.append(device_info)
+        # 保持按命中可能性排列的顺序
+        for ip in history_ips:
+            if ip not in open_ips:
+                self.scanner.registry.record_failure(ip)
+                continue
+            device_info = self.check_device(ip)
+            if device_info:
+                devices.append(device_info)
         
         return devices
     
     def scan_network(self, subnet):
-        """扫描指定网段的设备"""
-        devices = []
-        
-        # 快速扫描常见的IP范围
-        common_ips = [f"{subnet}.{i}" for i in range(1, 255)]
+        """扫描指定网段的设备；subnet 可以是 "192.168.1" 形式的 /24 前缀或任意 CIDR"""
+        networks = parse_networks(subnet) if '/' in subnet else [ipaddress.IPv4Network(f"{subnet}.0/24")]
         
-        # 使用多线程并行扫描
-        threads = []
+        # 整段并发扫描端口，只对开放的地址做 ADB 检查
         results = []
-        
-        def scan_ip(ip):
+        for ip in self.scanner.sweep_networks(networks):
             device_info = self.check_device(ip)
             if device_info:
                 results.append(device_info)
         
-        for ip in common_ips:
-            thread = threading.Thread(target=scan_ip, args=(ip,))
-            threads.append(thread)
-            thread.start()
-            # 限制并发数
-            if len(threads) >= 50:
-                for t in threads:
-                    t.join()
-                threads = []
-        
-        # 等待剩余线程完成
-        for thread in threads:
-            thread.join()
-        
         return results
     
     def check_device(self, ip):
-        """检查指定IP是否为ADB设备"""
+        """检查指定IP是否为ADB设备；调用方先用端口扫描确认 5555 已开放"""
         try:
-            # 检查端口5555是否开放
-            if not self.is_port_open(ip, 5555):
-                return None
-            
+            started = time.monotonic()
             # 尝试ADB连接
-            result = subprocess.run(
-                ['adb', 'connect', f'{ip}:5555'],
-                capture_output=True,
-                text=True,
-                timeout=self.timeout
-            )
+            self.scanner.adb.connect(ip, 5555, timeout=self.timeout)
             
             # 检查是否连接成功
-            device_result = subprocess.run(
-                ['adb', 'devices'],
-                capture_output=True,
-                text=True
-            )
-            
-            if f'{ip}:5555' in device_result.stdout and 'device' in device_result.stdout:
+            if self.scanner.is_adb_device(ip):
                 # 获取设备名称
                 device_name = self.get_device_name(ip)
+                self.scanner.save_history_ip(ip, {"model": device_name}, time.monotonic() - started)
                 
                 # 断开连接
-                subprocess.run(['adb', 'disconnect', f'{ip}:5555'], 
-                             capture_output=True)
+                self.scanner.adb.disconnect(ip, 5555)
                 
                 return {
                     'ip': ip,
@@ -598,23 +693,13 @@ class ADBDeviceManager:
                     'connected': False
                 }
             
-        except (subprocess.TimeoutExpired, subprocess.CalledProcessError):
+        except (socket.timeout, AdbError):
             pass
         except Exception as e:
             print(f"Error checking device {ip}: {e}")
         
         return None
     
-    def is_port_open(self, ip, port):
-        """检查指定IP的端口是否开放"""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(1)
-                result = s.connect_ex((ip, port))
-                return result == 0
-        except:
-            return False
-    
     def is_valid_ip(self, ip):
         """验证IP地址格式"""
         try:
@@ -626,14 +711,7 @@ class ADBDeviceManager:
     def get_device_name(self, ip):
         """获取设备名称"""
         try:
-            result = subprocess.run(
-                ['adb', '-s', f'{ip}:5555', 'shell', 'getprop', 'ro.product.model'],
-                capture_output=True,
-                text=True,
-                timeout=self.timeout
-            )
-            if result.returncode == 0:
-                return result.stdout.strip()
+            return self.scanner.adb.getprop(f'{ip}:5555', 'ro.product.model', timeout=self.timeout) or None
         except:
             pass
         return None
@@ -642,24 +720,11 @@ class ADBDeviceManager:
         """连接设备并启动指定应用"""
         try:
             # 连接设备
-            result = subprocess.run(
-                ['adb', 'connect', f'{ip}:5555'],
-                capture_output=True,
-                text=True,
-                timeout=self.timeout
-            )
-            
-            if 'unable' in result.stdout.lower():
+            if not self.scanner.adb.connect(ip, 5555, timeout=self.timeout):
                 return {"success": False, "error": "无法连接到设备"}
             
             # 验证连接
-            device_result = subprocess.run(
-                ['adb', 'devices'],
-                capture_output=True,
-                text=True
-            )
-            
-            if f'{ip}:5555' not in device_result.stdout or 'device' not in device_result.stdout:
+            if not self.scanner.is_adb_device(ip):
                 return {"success": False, "error": "ADB连接失败"}
             
             # 启动指定应用 - 实际调用scrcpy或相关脚本
@@ -684,33 +749,16 @@ class ADBDeviceManager:
                                stdout=subprocess.DEVNULL, 
                                stderr=subprocess.DEVNULL)
             
-            # 添加到历史记录
-            self.add_to_history(ip)
+            # 记录到设备注册表
+            self.scanner.save_history_ip(ip)
             
             return {"success": True, "message": f"设备 {ip} 连接成功，正在启动 {app}"}
             
-        except subprocess.TimeoutExpired:
+        except socket.timeout:
             return {"success": False, "error": "连接超时"}
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def add_to_history(self, ip):
-        """添加IP到历史记录"""
-        try:
-            if os.path.exists(self.ip_history_file):
-                with open(self.ip_history_file, 'r') as f:
-                    existing_ips = [line.strip() for line in f if line.strip()]
-            else:
-                existing_ips = []
-            
-            if ip not in existing_ips:
-                existing_ips.append(ip)
-                with open(self.ip_history_file, 'w') as f:
-                    for existing_ip in existing_ips:
-                        f.write(f"{existing_ip}\n")
-        except Exception as e:
-            print(f"Error adding to history: {e}")
-
 
 class ADBRequestHandler(BaseHTTPRequestHandler):
     def __init__(self, *args, manager=None, **kwargs):
@@ -724,19 +772,17 @@ class ADBRequestHandler(BaseHTTPRequestHandler):
         if path == '/status':
             self.send_json_response(scan_status)
         elif path == '/history':
-            history_ips = self.manager.scanner.load_history_ips()
-            self.send_json_response({"history": history_ips})
+            # history 保持为 IP 列表（按命中可能性排序），devices 为完整记录
+            registry = self.manager.scanner.registry
+            self.send_json_response({"history": registry.ranked(), "devices": registry.summary()})
         elif path == '/devices':
             try:
-                result = subprocess.run(['adb', 'devices'], capture_output=True, text=True)
                 devices = []
-                for line in result.stdout.split('\n')[1:]:
-                    if line.strip():
-                        parts = line.split('\t')
-                        if len(parts) >= 2:
-                            ip = parts[0].replace(':5555', '')
-                            status = parts[1]
-                            devices.append({"ip": ip, "status": status})
+                tracker = self.manager.scanner.tracker
+                connected = tracker.devices if tracker.ready.is_set() else self.manager.scanner.adb.devices()
+                for serial, status in connected.items():
+                    ip = serial.replace(':5555', '')
+                    devices.append({"ip": ip, "status": status})
                 self.send_json_response({"devices": devices})
             except:
                 self.send_json_response({"devices": []})
@@ -754,6 +800,26 @@ class ADBRequestHandler(BaseHTTPRequestHandler):
             
             if path == '/scan':
                 if not scan_status["is_scanning"]:
+                    # 可选的扫描参数：并发连接数与连接超时（秒）
+                    try:
+                        concurrency = int(data.get('concurrency', SWEEP_CONCURRENCY))
+                        timeout = float(data.get('timeout', SWEEP_TIMEOUT))
+                    except (TypeError, ValueError):
+                        self.send_json_response({"error": "concurrency 和 timeout 必须是数字"}, 400)
+                        return
+                    if concurrency < 1 or timeout <= 0:
+                        self.send_json_response({"error": "concurrency 必须大于等于 1，timeout 必须大于 0"}, 400)
+                        return
+                    self.manager.scanner.sweep_concurrency = concurrency
+                    self.manager.scanner.sweep_timeout = timeout
+                    # 可选：要扫描的网段，如 "10.20.0.0/22" 或列表，默认为所有网卡所在网段
+                    cidrs = data.get('cidrs') or data.get('cidr')
+                    if cidrs:
+                        try:
+                            parse_networks(cidrs)
+                        except ValueError as e:
+                            self.send_json_response({"error": f"无效的网段: {e}"}, 400)
+                            return
                     def scan_thread():
                         def progress_callback(progress, stage, devices):
                             scan_status["progress"] = progress
@@ -768,7 +834,7 @@ class ADBRequestHandler(BaseHTTPRequestHandler):
                         
                         try:
                             # 使用新的扫描方法，完全模拟 scan.command
-                            self.manager.scanner.scan_devices(progress_callback)
+                            self.manager.scanner.scan_devices(progress_callback, cidrs)
                         except Exception as e:
                             print(f"扫描异常: {e}")
                             scan_status["stage"] = f"扫描错误: {e}"
@@ -792,7 +858,7 @@ class ADBRequestHandler(BaseHTTPRequestHandler):
                 try:
                     if self.manager.scanner.adb_connect(ip):
                         device_info = self.manager.scanner.get_device_info(ip)
-                        self.manager.scanner.save_history_ip(ip)
+                        self.manager.scanner.save_history_ip(ip, device_info)
                         self.send_json_response({"message": "连接成功", "device": device_info})
                     else:
                         self.send_json_response({"error": "连接失败"}, 400)
@@ -827,7 +893,14 @@ class ADBRequestHandler(BaseHTTPRequestHandler):
             
             elif path == '/scan-devices':
                 self.manager.timeout = int(data.get('timeout', 3))
-                result = self.manager.scan_devices()
+                cidrs = data.get('cidrs') or data.get('cidr')
+                if cidrs:
+                    try:
+                        parse_networks(cidrs)
+                    except ValueError as e:
+                        self.send_json_response({"success": False, "error": f"无效的网段: {e}"}, 400)
+                        return
+                result = self.manager.scan_devices(cidrs)
                 self.send_json_response(result)
             
             elif path == '/connect-device':